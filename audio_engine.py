@@ -0,0 +1,28 @@
+from video_engine import run_batch, convert_video
+
+
+FORMAT_CODECS = {
+    'wav': ['pcm_s16le'],
+    'mp3': ['libmp3lame'],
+    'aac': ['aac', 'libfdk_aac'],
+    'm4a': ['aac', 'alac'],
+    'ogg': ['libvorbis'],
+    'flac': ['flac'],
+    'opus': ['opus']
+}
+
+
+def convert_audio(job, output_format, codec, logger=None, token=None, cache=None):
+    # job from probe_video. Same path as a video converted to an audio format: the first audio stream is
+    # copied when it already has the target codec, otherwise one ffmpeg process decodes and encodes it,
+    # so PCM never passes through Python. moviepy's AudioFileClip only reads what the probe couldn't.
+    convert_video(job, output_format, codec, logger=logger, token=token, cache=cache)
+
+
+def convert_audios(input_paths, output_format, codec, output_dir=None, max_jobs=None, on_start=None, on_done=None, token=None, cache=None,
+                   staging=None, journal=None, batch=None, template=None, metrics=None):
+    # Same callbacks and journal handling as video_engine.convert_videos; every job counts as one thread against the CPU budget
+    settings = {'output_format': output_format, 'codec': codec, 'output_dir': output_dir, 'max_jobs': max_jobs, 'template': template}
+    run_batch('audio', settings, input_paths, output_format, output_dir, template,
+              lambda job, logger: convert_audio(job, output_format, codec, logger, token, cache),
+              on_start, on_done, token, staging, journal, batch, metrics, audio_only=True, max_jobs=max_jobs)
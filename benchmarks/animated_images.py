@@ -0,0 +1,99 @@
+# Converts one animation with the streaming frame path and with the usual
+# "collect every frame, then save_all" approach, recording time and peak memory:
+#   python -m benchmarks.animated_images [animation] --format WebP --output animated.json
+# Without an input, a 500-frame 640x360 GIF is generated with Pillow.
+# Each run happens in a fresh process so peak RSS belongs to that run alone.
+from concurrent.futures import ProcessPoolExecutor
+from image_engine import convert_image, save_options
+import argparse
+import tempfile
+import json
+import time
+import os
+
+
+def make_reference_animation(path, frames=500, size=(640, 360)):
+    from PIL import Image, ImageDraw
+
+    def frame(index):
+        image = Image.new('RGB', size, (index % 256, 96, 160))
+        x = index * 4 % (size[0] - 60)
+        ImageDraw.Draw(image).ellipse((x, size[1] // 2 - 30, x + 60, size[1] // 2 + 30), fill=(255, 220, 0))
+        return image
+
+    first = frame(0)
+    first.save(path, save_all=True, append_images=(frame(index) for index in range(1, frames)),
+               duration=[40, 50, 60] * (frames // 3) + [40] * (frames % 3), loop=0)
+
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_streamed(animation, output_path, image_format, quality):
+    start = time.perf_counter()
+    convert_image(animation, output_path, image_format, quality)
+    return time.perf_counter() - start, peak_rss()
+
+
+def run_collected(animation, output_path, image_format, quality):
+    from PIL import Image, ImageSequence
+    start = time.perf_counter()
+    with Image.open(animation) as image:
+        frames = [frame.copy() for frame in ImageSequence.Iterator(image)]
+    # the engine's save options, so only the frame handling differs
+    frames[0].save(output_path, format=image_format, save_all=True, append_images=frames[1:], **save_options(image_format, quality),
+                   duration=[frame.info.get('duration', 0) for frame in frames], loop=0)
+    return time.perf_counter() - start, peak_rss()
+
+
+def run(animation, image_format, quality):
+    from PIL import Image
+    with Image.open(animation) as image:
+        frames = image.n_frames
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, method in [('streamed', run_streamed), ('collected', run_collected)]:
+            output_path = os.path.join(temp_dir, f'{name}.{image_format.lower()}')
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                seconds, rss = executor.submit(method, animation, output_path, image_format, quality).result()
+            results.append({
+                'method': name,
+                'format': image_format,
+                'frames': frames,
+                'seconds': round(seconds, 3),
+                'fps': round(frames / seconds, 2),
+                'bytes': os.path.getsize(output_path),
+                'peak_rss': rss
+            })
+            memory = f"{rss / 1024**2:8.1f} MB peak" if rss else ''
+            print(f"{name:>10}  {results[-1]['fps']:8.2f} frames/s  {seconds:7.2f} s  {results[-1]['bytes'] / 1024**2:7.2f} MB  {memory}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Animated image conversion speed and memory')
+    parser.add_argument('animation', nargs='?', help='animated GIF/WebP/APNG (default: generated 500-frame GIF)')
+    parser.add_argument('--format', default='WebP')
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        animation = args.animation
+        if not animation:
+            animation = os.path.join(temp_dir, 'reference.gif')
+            make_reference_animation(animation)
+        results = run(animation, args.format, args.quality)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
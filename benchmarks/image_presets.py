@@ -0,0 +1,79 @@
+# Encodes a sample corpus with every format and effort preset and records encode time and output size:
+#   python -m benchmarks.image_presets [images...] --quality High --formats PNG WebP --output presets.json
+# Without images, a photo-like, a flat-graphic and a greyscale scan-like image are generated with Pillow.
+from image_engine import IMAGE_FORMATS, QUALITY_PRESETS, EFFORT_PRESETS, save_options
+import argparse
+import json
+import time
+import io
+
+
+def make_corpus(size=(1600, 1200)):
+    from PIL import Image, ImageDraw
+    photo = Image.effect_mandelbrot(size, (-2.2, -1.2, 1.0, 1.2), 256)
+    photo = Image.merge('RGB', [photo, Image.effect_noise(size, 24).point(lambda v: v // 2), photo.rotate(180)])
+    graphic = Image.new('RGB', size, (245, 245, 245))
+    draw = ImageDraw.Draw(graphic)
+    for index in range(40):
+        x, y = index * 37 % size[0], index * 53 % size[1]
+        draw.rectangle((x, y, x + 200, y + 60), fill=(index * 6 % 256, 120, 200), outline=(0, 0, 0))
+        draw.text((x + 10, y + 20), f'Button {index}', fill=(255, 255, 255))
+    scan = Image.linear_gradient('L').resize(size)
+    scan = Image.blend(scan, Image.effect_noise(size, 40), 0.3)
+    return {'photo': photo, 'graphic': graphic, 'scan': scan}
+
+
+def load_corpus(paths):
+    from PIL import Image
+    corpus = {}
+    for path in paths:
+        with Image.open(path) as image:
+            image.load()
+            corpus[path] = image.convert('RGB') if image.mode not in ['RGB', 'L'] else image.copy()
+    return corpus
+
+
+def run(corpus, formats, quality):
+    results = []
+    for image_format in formats:
+        for effort in EFFORT_PRESETS:
+            options = save_options(image_format, quality, effort)
+            seconds = 0
+            size = 0
+            for image in corpus.values():
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                image.save(buffer, format=image_format, **options)
+                seconds += time.perf_counter() - start
+                size += buffer.tell()
+            results.append({
+                'format': image_format,
+                'effort': effort,
+                'quality': quality,
+                'options': options,
+                'seconds': round(seconds, 3),
+                'bytes': size
+            })
+            print(f"{image_format:>5} {effort:>9}  {seconds * 1000:9.1f} ms  {size / 1024:10.1f} KB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encode time and size per image format and effort preset')
+    parser.add_argument('images', nargs='*', help='sample images (default: generated corpus)')
+    parser.add_argument('--quality', default='High', help='Lossless, High, Medium, Low or 1-100')
+    parser.add_argument('--formats', nargs='+', default=IMAGE_FORMATS, choices=IMAGE_FORMATS)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    quality = int(args.quality) if args.quality.isdigit() else QUALITY_PRESETS[args.quality.capitalize()]
+    corpus = load_corpus(args.images) if args.images else make_corpus()
+    results = run(corpus, args.formats, quality)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
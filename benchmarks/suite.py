@@ -0,0 +1,219 @@
+# Runs the video, audio, GIF and image engines headless over a synthetic corpus and records, per
+# format/codec combination, files/s, MB/s, wall time, CPU time (ffmpeg and pool workers included) and peak RSS:
+#   python -m benchmarks.suite --output before.json
+#   python -m benchmarks.suite --output after.json --compare before.json --threshold 10
+# With --compare, combinations more than --threshold percent slower (wall time) or larger (peak RSS) than the
+# baseline are flagged and the exit status is 1. The corpus is generated with ffmpeg testsrc2/sine and Pillow,
+# the same bytes every time; --corpus keeps it in a folder between runs. Each combination runs --repeat times
+# in a fresh process, and the median run is kept.
+from concurrent.futures import ProcessPoolExecutor
+from video_engine import convert_videos
+from audio_engine import convert_audios
+from gif_engine import convert_gifs
+from image_engine import QUALITY_PRESETS, convert_images, parse_sizes
+from ffmpeg_tools import ffmpeg_binary, run_ffmpeg
+import subprocess
+import argparse
+import platform
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+
+# Each entry is one result row: an engine, a target and its settings
+CASES = [
+    {'kind': 'video', 'format': 'mp4', 'codec': 'libx264'},
+    {'kind': 'video', 'format': 'webm', 'codec': 'libvpx'},
+    {'kind': 'video', 'format': 'mkv', 'codec': 'mpeg4'},  # the corpus codec: remuxed
+    {'kind': 'gif', 'format': 'gif', 'codec': 'gif'},
+    {'kind': 'gif', 'format': 'webp', 'codec': 'libwebp_anim'},
+    {'kind': 'audio', 'format': 'mp3', 'codec': 'libmp3lame'},
+    {'kind': 'audio', 'format': 'ogg', 'codec': 'libvorbis'},
+    {'kind': 'audio', 'format': 'flac', 'codec': 'flac'},
+    {'kind': 'audio', 'format': 'aac', 'codec': 'aac'},
+    {'kind': 'image', 'format': 'JPEG', 'quality': 'High'},
+    {'kind': 'image', 'format': 'WebP', 'quality': 'High'},
+    {'kind': 'image', 'format': 'PNG', 'quality': 'Lossless'},
+    {'kind': 'image', 'format': 'JPEG', 'quality': 'High', 'sizes': '1024 256'}
+]
+
+# Which part of the corpus each engine converts
+CORPUS_KIND = {'video': 'video', 'gif': 'video', 'audio': 'audio', 'image': 'image'}
+
+
+def case_name(case):
+    name = f"{case['kind']} {case['format']} {case.get('codec') or case['quality']}"
+    return name + (f" {case['sizes']}" if case.get('sizes') else '')
+
+
+def make_corpus(directory):
+    # -> {'video': [...], 'audio': [...], 'image': [...]}; files already there are reused
+    os.makedirs(directory, exist_ok=True)
+    corpus = {'video': [], 'audio': [], 'image': []}
+
+    def make(kind, name, create):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            create(path + '.tmp' + os.path.splitext(name)[1])
+            os.replace(path + '.tmp' + os.path.splitext(name)[1], path)
+        corpus[kind].append(path)
+
+    # MPEG-4 Part 2 with MP3, which none of the video cases but the remux one can copy
+    for size, seconds in [('640x360', 10), ('1280x720', 5), ('1920x1080', 3)]:
+        make('video', f'testsrc2_{size}.mkv', lambda path, size=size, seconds=seconds: run_ffmpeg([
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={seconds}',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={seconds}',
+            '-c:v', 'mpeg4', '-q:v', '3', '-c:a', 'libmp3lame', '-shortest', path]))
+    for frequency, extension in [(440, 'wav'), (1000, 'mp3'), (220, 'flac')]:
+        make('audio', f'sine_{frequency}.{extension}', lambda path, frequency=frequency: run_ffmpeg([
+            '-f', 'lavfi', '-i', f'sine=frequency={frequency}:sample_rate=44100:duration=60', '-ac', '2', path]))
+    for width, height, extension in [(640, 480, 'png'), (1920, 1080, 'jpg'), (1920, 1080, 'png'), (4000, 3000, 'jpg')]:
+        make('image', f'pattern_{width}x{height}.{extension}', lambda path, size=(width, height): make_image(size).save(path))
+    return corpus
+
+
+def make_image(size):
+    # Photo-like detail from a Mandelbrot set under two gradients; deterministic, unlike Pillow's noise effects
+    from PIL import Image
+    detail = Image.effect_mandelbrot(size, (-2.2, -1.2, 1.0, 1.2), 256)
+    horizontal = Image.linear_gradient('L').rotate(90).resize(size)
+    vertical = Image.linear_gradient('L').resize(size)
+    return Image.merge('RGB', [detail, horizontal, Image.blend(vertical, detail, 0.5)])
+
+
+def usage():
+    # -> (cpu seconds, peak RSS in bytes) of this process and every child it waited for
+    times = os.times()
+    cpu = times.user + times.system + times.children_user + times.children_system
+    try:
+        import resource
+    except ImportError:
+        return cpu, None  # Windows
+    scale = 1 if sys.platform == 'darwin' else 1024
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return cpu, rss * scale
+
+
+def run_case(case, inputs, output_dir):
+    # Runs in a fresh process, so CPU time and peak RSS belong to this run alone
+    failed = []
+    on_done = lambda job, error: error and failed.append(f'{job.input_path}: {error}')
+    cpu_before, _ = usage()
+    start = time.perf_counter()
+    if case['kind'] == 'image':
+        convert_images(inputs, case['format'], QUALITY_PRESETS[case['quality']], output_dir=output_dir,
+                       on_done=lambda input_path, output_path, error: error and failed.append(f'{input_path}: {error}'),
+                       sizes=parse_sizes(case.get('sizes', '')))
+    elif case['kind'] == 'audio':
+        convert_audios(inputs, case['format'], case['codec'], output_dir, on_done=on_done)
+    elif case['kind'] == 'gif':
+        convert_gifs(inputs, case['format'], case['codec'], output_dir=output_dir, on_done=on_done)
+    else:
+        convert_videos(inputs, case['format'], case['codec'], output_dir=output_dir, on_done=on_done)
+    wall = time.perf_counter() - start
+    cpu_after, rss = usage()
+    return wall, cpu_after - cpu_before, rss, failed
+
+
+def measure(case, inputs, repeat):
+    runs = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index in range(repeat):
+            output_dir = os.path.join(temp_dir, str(index))
+            os.makedirs(output_dir)
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                wall, cpu, rss, failed = executor.submit(run_case, case, inputs, output_dir).result()
+            if failed:
+                raise RuntimeError('; '.join(failed))
+            outputs = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+            runs.append((wall, cpu, rss, outputs))
+    wall, cpu, rss, outputs = sorted(runs)[len(runs) // 2]
+    bytes_in = sum(os.path.getsize(path) for path in inputs)
+    return {
+        'case': case_name(case),
+        **case,
+        'files': len(inputs),
+        'bytes_in': bytes_in,
+        'bytes_out': outputs,
+        'wall_seconds': round(wall, 3),
+        'wall_seconds_runs': [round(run[0], 3) for run in runs],
+        'cpu_seconds': round(cpu, 3),
+        'peak_rss': rss,
+        'files_per_second': round(len(inputs) / wall, 3),
+        'mb_per_second': round(bytes_in / 1024**2 / wall, 3)
+    }
+
+
+def machine():
+    try:
+        version = subprocess.run([ffmpeg_binary(), '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        version = None
+    return {'platform': platform.platform(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'ffmpeg': version}
+
+
+def compare(baseline, results, threshold):
+    # -> names of the cases that got slower or hungrier by more than threshold percent
+    before = {result['case']: result for result in baseline['results']}
+    if baseline.get('machine') != machine():
+        print('Note: the baseline was recorded on a different machine or toolchain')
+    regressions = []
+    for result in results:
+        old = before.get(result['case'])
+        if not old:
+            continue
+        changes = []
+        for field in ['wall_seconds', 'peak_rss']:
+            if old.get(field) and result.get(field):
+                change = (result[field] / old[field] - 1) * 100
+                changes.append(f"{field} {change:+.1f}%")
+                if change > threshold:
+                    regressions.append(result['case'])
+        flag = '  REGRESSION' if result['case'] in regressions else ''
+        print(f"{result['case']:>28}  {'  '.join(changes)}{flag}")
+    return sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput, CPU time and memory of every converter')
+    parser.add_argument('--corpus', help='folder for the generated corpus, kept between runs (default: a temporary one)')
+    parser.add_argument('--cases', nargs='+', metavar='TEXT', help='only the cases whose name contains one of these, e.g. audio "video mp4"')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the median is kept')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=10, help='percent slower or larger that counts as a regression')
+    args = parser.parse_args()
+
+    cases = [case for case in CASES if not args.cases or any(text in case_name(case) for text in args.cases)]
+    temp_dir = None if args.corpus else tempfile.mkdtemp(prefix='FileConverter-corpus-')
+    try:
+        corpus = make_corpus(args.corpus or temp_dir)
+        results = []
+        for case in cases:
+            result = measure(case, corpus[CORPUS_KIND[case['kind']]], args.repeat)
+            results.append(result)
+            memory = f"{result['peak_rss'] / 1024**2:8.1f} MB peak" if result['peak_rss'] else ''
+            print(f"{result['case']:>28}  {result['files_per_second']:7.2f} files/s  {result['mb_per_second']:7.2f} MB/s  "
+                  f"{result['wall_seconds']:7.2f} s  {result['cpu_seconds']:7.2f} s CPU  {memory}")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'machine': machine(), 'repeat': args.repeat, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression{'s' if len(regressions) > 1 else ''} over {args.threshold:g}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Encodes one reference clip with every preset and records encode fps and output size,
+# to pick a speed/quality setting for the farm:
+#   python -m benchmarks.video_presets [clip] --codec libx264 --crf 23 --output presets.json
+# Without a clip, a 1080p testsrc2 clip is generated with ffmpeg.
+from video_engine import PRESETS, probe_video, plan_threads, transcode
+from ffmpeg_tools import run_ffmpeg, first_stream
+import argparse
+import tempfile
+import json
+import time
+import os
+
+
+def make_reference_clip(path, seconds=10, size='1920x1080', fps=30):
+    run_ffmpeg([
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={fps}',
+        '-t', str(seconds), '-c:v', 'libx264', '-crf', '12', '-pix_fmt', 'yuv420p', path
+    ])
+
+
+def run(clip, codec, output_format, crf=None, bitrate=None, threads=None, presets=PRESETS):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for preset in presets:
+            job = probe_video(clip, os.path.join(temp_dir, f'{preset}.{output_format}'))
+            job.threads = threads or plan_threads(job, os.cpu_count() or 1)
+            frames = int(job.duration * (first_stream(job.info, 'video') or {}).get('fps', 0))
+            start = time.perf_counter()
+            transcode(job, output_format, codec, audio=False, encoder_options={'preset': preset, 'crf': crf, 'bitrate': bitrate})
+            seconds = time.perf_counter() - start
+            results.append({
+                'preset': preset,
+                'codec': codec,
+                'threads': job.threads,
+                'seconds': round(seconds, 3),
+                'fps': round(frames / seconds, 2),
+                'bytes': os.path.getsize(job.output_path)
+            })
+            print(f"{preset:>10}  {results[-1]['fps']:8.2f} fps  {results[-1]['bytes'] / 1024**2:8.2f} MB  {seconds:7.2f} s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encode speed and size per preset')
+    parser.add_argument('clip', nargs='?', help='reference clip (default: generated 1080p testsrc2)')
+    parser.add_argument('--codec', default='libx264')
+    parser.add_argument('--format', default='mp4')
+    parser.add_argument('--crf', type=int)
+    parser.add_argument('--bitrate')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--presets', nargs='+', default=PRESETS, choices=PRESETS)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clip = args.clip
+        if not clip:
+            clip = os.path.join(temp_dir, 'reference.mp4')
+            make_reference_clip(clip)
+        results = run(clip, args.codec, args.format, args.crf, args.bitrate, args.threads, args.presets)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
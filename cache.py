@@ -0,0 +1,169 @@
+from contextlib import closing
+import hashlib
+import sqlite3
+import shutil
+import json
+import time
+import sys
+import os
+
+
+DEFAULT_MAX_BYTES = 5 * 1024**3
+
+FICLONE = 0x40049409  # Linux ioctl: share the source's extents copy-on-write (btrfs, XFS)
+
+
+def default_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'FileConverter')
+
+
+def place(source, destination):
+    # A reflink where the filesystem has them, a copy otherwise. Never a hardlink: outputs are the
+    # user's to edit, and a shared inode would carry every edit into the cache and the other outputs.
+    if sys.platform.startswith('linux'):
+        import fcntl
+        try:
+            with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            return
+        except FileNotFoundError:
+            raise
+        except OSError:
+            pass  # no reflinks here (ext4, tmpfs) or across filesystems
+    shutil.copyfile(source, destination)
+
+
+class ConversionCache():
+    # Finished outputs stored under hash(source bytes + conversion parameters).
+    # When each entry was last used is kept in a small SQLite index beside them; eviction drops the
+    # least recently used. Connections are opened per call, as pool workers get their own copy of the cache.
+    # Off unless asked for, since every cached conversion first reads its whole source to hash it.
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, enabled=False):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def covers(self, input_path):
+        # A source larger than the whole cache can't have an entry worth its hash
+        return self.enabled and os.path.getsize(input_path) <= self.max_bytes
+
+    def key(self, input_path, params):
+        digest = hashlib.blake2b(digest_size=20)
+        with open(input_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def index(self):
+        # In its own folder, so entries() never lists it
+        path = os.path.join(self.directory, 'index', 'used.sqlite3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS used (key TEXT PRIMARY KEY, used REAL NOT NULL)')
+        return connection
+
+    def touch(self, key):
+        try:
+            with closing(self.index()) as index:
+                index.execute('INSERT OR REPLACE INTO used VALUES (?, ?)', (key, time.time()))
+        except sqlite3.Error as e:
+            print(f"Error updating the cache index: {e}")
+
+    def forget(self, keys):
+        try:
+            with closing(self.index()) as index:
+                index.executemany('DELETE FROM used WHERE key = ?', [(key,) for key in keys])
+        except sqlite3.Error as e:
+            print(f"Error updating the cache index: {e}")
+
+    def fetch(self, key, output_path):
+        if not self.enabled:
+            return False
+        try:
+            place(self.entry_path(key), output_path)
+        except FileNotFoundError:
+            return False
+        self.touch(key)
+        return True
+
+    def store(self, key, output_path):
+        if not self.enabled:
+            return
+        try:
+            if os.path.getsize(output_path) > self.max_bytes:
+                return  # would only evict everything else and then itself
+        except OSError:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self.entry_path(key)
+        temp_entry = f"{entry}.{os.getpid()}.tmp"
+        try:
+            place(output_path, temp_entry)
+            os.replace(temp_entry, entry)
+        except OSError as e:
+            print(f"Error caching {output_path}: {e}")
+            try:
+                os.remove(temp_entry)
+            except OSError:
+                pass
+            return
+        self.touch(key)
+        self.evict()
+
+    def entries(self):
+        # -> [(last used, size, name)]; entries the index doesn't know fall back to their mtime
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        try:
+            with closing(self.index()) as index:
+                used = dict(index.execute('SELECT key, used FROM used').fetchall())
+        except sqlite3.Error:
+            used = {}
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # evicted by another worker meanwhile
+            if not os.path.isfile(os.path.join(self.directory, name)):
+                continue  # the job journal's and the index's folders
+            entries.append((used.get(name, stat.st_mtime), stat.st_size, name))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def remove(self, names):
+        removed = []
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed.append(name)
+            except OSError:
+                pass
+        if removed:
+            self.forget(removed)
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            evicted.append(name)
+            total -= size
+        self.remove(evicted)
+
+    def clear(self):
+        self.remove([name for _, _, name in self.entries()])
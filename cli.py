@@ -0,0 +1,278 @@
+# Headless entry point over the same engines the GUI uses, e.g.
+#   python cli.py video "shoots/**/*.mov" -f mp4 -c libx264 --crf 23 -o out/ --jobs 4
+#   python cli.py image scans/ -r -f WebP --quality Medium
+#   python cli.py image photos/ -f JPEG --size 2048 1024 256 -o web/
+#   python cli.py video clip.mov -f gif --width 480 --fps 12
+#   python cli.py video --resume      (finish video batches cut short by a crash or Ctrl+C)
+#   python cli.py image inbox/ -f WebP -o outbox/ --watch      (convert whatever lands in inbox/ until Ctrl+C)
+from video_engine import FORMAT_CODECS as VIDEO_FORMAT_CODECS, PRESETS, convert_videos
+from audio_engine import FORMAT_CODECS as AUDIO_FORMAT_CODECS, convert_audios
+from gif_engine import FORMAT_CODECS as GIF_FORMAT_CODECS, convert_gifs
+from image_engine import IMAGE_FORMATS, QUALITY_PRESETS, EFFORT_PRESETS, convert_images, parse_sizes
+from jobs import CancelToken, ConversionCancelled
+from cache import ConversionCache
+from journal import JobJournal
+from metrics import MetricsLog, DEFAULT_HOST as DEFAULT_METRICS_HOST
+from naming import check_template
+from pipeline import Staging
+from watch import FolderWatch, ProcessedIndex, SETTLE_SECONDS, default_watch_dir, recover
+import multiprocessing
+import argparse
+import glob
+import json
+import sys
+import os
+
+
+EXTENSIONS = {
+    'video': ['.mp4', '.avi', '.webm', '.mkv', '.mov', '.flv', '.ts', '.ogv', '.3gp', '.gif', '.m4v', '.mpg', '.mpeg', '.wmv'],
+    'audio': ['.wav', '.mp3', '.aac', '.m4a', '.ogg', '.flac', '.opus', '.wma', '.aiff'],
+    'image': ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp']
+}
+
+
+def collect_inputs(patterns, kind, recursive=False):
+    # Files are taken as given; directories and glob patterns are filtered by the kind's extensions
+    found = []
+    for pattern in patterns:
+        if os.path.isfile(pattern):
+            found.append(pattern)
+            continue
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*') if recursive else os.path.join(pattern, '*')
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in EXTENSIONS[kind]:
+                found.append(path)
+    return list(dict.fromkeys(found))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert video, audio and image files without the GUI')
+    parser.add_argument('kind', choices=['video', 'audio', 'image'])
+    parser.add_argument('inputs', nargs='*', help='files, directories or glob patterns (quote ** patterns)')
+    parser.add_argument('--resume', action='store_true',
+                        help='finish the unfinished batches of this kind, with the settings and output names they started with')
+    parser.add_argument('-r', '--recursive', action='store_true', help='descend into directories')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and convert files as they arrive in the input directories (needs -o)')
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS, metavar='SECONDS',
+                        help='with --watch: how long a new file must stop changing before it is converted')
+    parser.add_argument('--poll', type=float, metavar='SECONDS',
+                        help='with --watch: rescan every SECONDS instead of using inotify (network shares)')
+    parser.add_argument('-o', '--output-dir', help='write outputs here instead of next to each input')
+    parser.add_argument('-n', '--name', metavar='TEMPLATE',
+                        help="output file name without extension, from {stem} {suffix} {format} {parent} {index}, e.g. '{parent}/{stem}_web'")
+    parser.add_argument('-f', '--format', help='target format, e.g. mp4, mp3, WebP')
+    parser.add_argument('-c', '--codec', help="encoder (default: the format's first codec)")
+    parser.add_argument('--fps', type=int, help='output frame rate (video; gif and webp default to 15)')
+    parser.add_argument('--width', type=int, help='output width in pixels, never upscaled (video to gif or webp, default: 480)')
+    parser.add_argument('--colors', type=int, help='palette size, 2-256 (video to gif, default: 256)')
+    parser.add_argument('--no-audio', action='store_true', help='drop the soundtrack (video)')
+    parser.add_argument('--preset', choices=PRESETS, help='encoder preset (video)')
+    parser.add_argument('--crf', type=int, help='constant quality value (video)')
+    parser.add_argument('--bitrate', help='target bitrate, e.g. 4M (video)')
+    parser.add_argument('--threads', type=int, help='encoder threads per job, or per piece with --segments (video)')
+    parser.add_argument('--segments', type=int, metavar='N',
+                        help='cut videos of a few minutes or more into up to N pieces encoded side by side (video)')
+    parser.add_argument('--quality', default='High', help='Lossless, High, Medium, Low or 1-100 (image)')
+    parser.add_argument('--effort', choices=EFFORT_PRESETS, help='encode time spent on smaller files (image, default: Balanced)')
+    parser.add_argument('--size', nargs='+', default=[],
+                        help='longest side in pixels or WxH; several sizes give one output each (image)')
+    parser.add_argument('--memory', type=int, help='memory budget per job in MB; larger images are streamed (image)')
+    parser.add_argument('-j', '--jobs', type=int, help='files converted at once (default: from CPU count)')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                        help='copy the next N inputs to local scratch while converting, write outputs back in the background')
+    parser.add_argument('--scratch', help='scratch directory for --prefetch (default: system temp)')
+    parser.add_argument('--cache', action='store_true', help='reuse outputs of identical earlier conversions (hashes every input first)')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='append per-file timings, CPU time, sizes and peak memory to FILE (.csv as CSV, otherwise JSON lines)')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT', help='serve running totals for Prometheus on PORT while converting')
+    parser.add_argument('--metrics-host', default=DEFAULT_METRICS_HOST, metavar='HOST',
+                        help=f'address --metrics-port listens on (default: {DEFAULT_METRICS_HOST}, this machine only; 0.0.0.0 for every interface)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.resume:
+        return resume(args)
+    if not args.inputs or not args.format:
+        print('Inputs and -f/--format are required unless resuming', file=sys.stderr)
+        return 2
+    formats = {'video': {**VIDEO_FORMAT_CODECS, **GIF_FORMAT_CODECS}, 'audio': AUDIO_FORMAT_CODECS, 'image': IMAGE_FORMATS}[args.kind]
+    if args.format not in formats and args.format.upper() not in [fmt.upper() for fmt in formats]:
+        print(f"Unknown {args.kind} format {args.format}, choose from: {', '.join(formats)}", file=sys.stderr)
+        return 2
+    if args.kind != 'image':
+        args.format = args.format.lower()  # the codec tables are keyed in lower case
+    elif not (args.quality.isdigit() and 1 <= int(args.quality) <= 100) and args.quality.capitalize() not in QUALITY_PRESETS:
+        print(f"Unknown quality {args.quality}, choose from: {', '.join(QUALITY_PRESETS)} or 1-100", file=sys.stderr)
+        return 2
+    try:
+        sizes = parse_sizes(' '.join(args.size))
+        check_template(args.name)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.colors is not None and not 2 <= args.colors <= 256:
+        print('--colors takes 2 to 256', file=sys.stderr)
+        return 2
+    if args.watch:
+        return watch(args, sizes)
+    inputs = collect_inputs(args.inputs, args.kind, args.recursive)
+    if not inputs:
+        print('No input files found', file=sys.stderr)
+        return 2
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    cache = ConversionCache(enabled=args.cache)
+    staging = Staging(args.prefetch, args.scratch)
+    journal = JobJournal()
+    metrics = MetricsLog(args.metrics, args.metrics_port, args.metrics_host)
+    token = CancelToken()
+    total = len(inputs) * (len(sizes) if sizes and args.kind == 'image' else 1)
+    on_done, failed = progress_printer(total)
+
+    try:
+        converter(args, sizes, cache, staging, journal, metrics)(inputs, on_done, token)
+    except KeyboardInterrupt:
+        # Left in the journal: `--resume` picks the batch up again
+        token.cancel()
+        print('Interrupted, continue with --resume', file=sys.stderr)
+        return 130
+    finally:
+        metrics.close()
+    return 1 if failed else 0
+
+
+def converter(args, sizes, cache, staging, journal, metrics):
+    # -> convert(inputs, on_done, token) with the engine and settings args ask for;
+    # on_done(input_path, output_path, error) runs once per output
+    job_done = lambda on_done: lambda job, error: on_done(job.input_path, job.output_path, error)
+    if args.kind == 'image':
+        image_format = next((fmt for fmt in IMAGE_FORMATS if fmt.lower() == args.format.lower()), args.format)
+        quality = int(args.quality) if args.quality.isdigit() else QUALITY_PRESETS[args.quality.capitalize()]
+        memory_budget = args.memory * 1024**2 if args.memory else None
+        return lambda inputs, on_done, token: convert_images(
+            inputs, image_format, quality, args.jobs, args.output_dir, on_done, token, cache, memory_budget,
+            sizes=sizes, effort=args.effort, staging=staging, journal=journal, template=args.name, metrics=metrics, on_note=print_note)
+    if args.kind == 'audio':
+        codec = args.codec or AUDIO_FORMAT_CODECS[args.format][0]
+        return lambda inputs, on_done, token: convert_audios(
+            inputs, args.format, codec, args.output_dir, args.jobs, on_done=job_done(on_done), token=token, cache=cache,
+            staging=staging, journal=journal, template=args.name, metrics=metrics)
+    if args.format in GIF_FORMAT_CODECS:
+        codec = args.codec or GIF_FORMAT_CODECS[args.format][0]
+        return lambda inputs, on_done, token: convert_gifs(
+            inputs, args.format, codec, args.fps, args.width, args.colors, args.output_dir, args.jobs,
+            on_done=job_done(on_done), token=token, cache=cache, staging=staging, journal=journal, template=args.name, metrics=metrics)
+    codec = args.codec or VIDEO_FORMAT_CODECS[args.format][0]
+    encoder_options = {'preset': args.preset, 'crf': args.crf, 'bitrate': args.bitrate}
+    return lambda inputs, on_done, token: convert_videos(
+        inputs, args.format, codec, args.fps, not args.no_audio, encoder_options, args.threads,
+        args.output_dir, args.jobs, on_done=job_done(on_done), token=token, cache=cache, staging=staging, journal=journal,
+        template=args.name, segments=args.segments, metrics=metrics)
+
+
+def watch(args, sizes):
+    # Drop-folder mode: runs until Ctrl+C. Already converted inputs are looked up in a persistent index,
+    # so a restart skips them; a batch cut short by a crash is cleaned up and its files converted again.
+    folders = [folder for folder in args.inputs if os.path.isdir(folder)]
+    if len(folders) != len(args.inputs):
+        print('--watch takes directories only', file=sys.stderr)
+        return 2
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else None
+    if not output_dir:
+        print('--watch needs -o/--output-dir, or outputs next to their inputs could be picked up as new files', file=sys.stderr)
+        return 2
+    os.makedirs(output_dir, exist_ok=True)
+
+    journal = JobJournal(os.path.join(default_watch_dir(), 'journal.sqlite3'))
+    recover(journal)
+    # Everything that decides what an output looks like; the index is kept per combination
+    target = ['kind', 'format', 'codec', 'fps', 'width', 'colors', 'no_audio', 'preset', 'crf', 'bitrate', 'segments',
+              'quality', 'effort', 'size', 'name']
+    profile = json.dumps({**{name: getattr(args, name) for name in target}, 'output_dir': output_dir}, sort_keys=True)
+    cache = ConversionCache(enabled=args.cache)
+    staging = Staging(args.prefetch, args.scratch)
+    metrics = MetricsLog(args.metrics, args.metrics_port, args.metrics_host)
+    token = CancelToken()
+    on_done, failed = progress_printer('?')
+    folder_watch = FolderWatch(folders, EXTENSIONS[args.kind], converter(args, sizes, cache, staging, journal, metrics),
+                               ProcessedIndex(), profile, token, args.recursive, args.settle, args.poll,
+                               queue_size=max(2, 2 * (args.jobs or os.cpu_count() or 1)), excluded=[output_dir], on_done=on_done)
+    try:
+        folder_watch.run()
+    except KeyboardInterrupt:
+        token.cancel()
+        print('Stopped', file=sys.stderr)
+    finally:
+        metrics.close()
+    return 0
+
+
+def progress_printer(total):
+    # -> (on_done(input_path, output_path, error), list the failed inputs are added to)
+    finished = []
+    failed = []
+
+    def on_done(input_path, output_path, error):
+        finished.append(input_path)
+        if error and not isinstance(error, ConversionCancelled):
+            print(f"[{len(finished)}/{total}] Error converting file {input_path}: {error}", file=sys.stderr)
+            failed.append(input_path)
+        elif not error:
+            print(f"[{len(finished)}/{total}] {input_path} -> {output_path}")
+
+    return on_done, failed
+
+
+def print_note(input_path, message):
+    print(f"{input_path}: {message}", file=sys.stderr)
+
+
+def resume(args):
+    journal = JobJournal()
+    # GIF and WebP animations are made in the video command but journaled as their own kind
+    kinds = ['video', 'gif'] if args.kind == 'video' else [args.kind]
+    unfinished = [batch for kind in kinds for batch in journal.unfinished(kind)]
+    if not unfinished:
+        print(f"No unfinished {args.kind} batches", file=sys.stderr)
+        return 0
+    cache = ConversionCache(enabled=args.cache)
+    staging = Staging(args.prefetch, args.scratch)
+    metrics = MetricsLog(args.metrics, args.metrics_port, args.metrics_host)
+    token = CancelToken()
+    failed = []
+    engines = {'video': convert_videos, 'gif': convert_gifs, 'audio': convert_audios, 'image': convert_images}
+    try:
+        for batch, kind, settings, count in unfinished:
+            if not journal.claim(batch):
+                print(f"Batch {batch} was resumed by another process", file=sys.stderr)
+                continue
+            convert = engines[kind]
+            jobs = journal.jobs(batch)
+            # image jobs list an output per size, the others a single path
+            total = sum(len(outputs) if isinstance(outputs, list) else 1 for _, outputs in jobs)
+            on_done, batch_failed = progress_printer(total)
+            print(f"Resuming {count} of batch {batch}")
+            if args.kind == 'image':
+                convert([], on_done=on_done, token=token, cache=cache, staging=staging, journal=journal, batch=batch, metrics=metrics,
+                        on_note=print_note, **settings)
+            else:
+                convert([], on_done=lambda job, error: on_done(job.input_path, job.output_path, error), token=token, cache=cache,
+                        staging=staging, journal=journal, batch=batch, metrics=metrics, **settings)
+            failed += batch_failed
+    except KeyboardInterrupt:
+        token.cancel()
+        print('Interrupted, continue with --resume', file=sys.stderr)
+        return 130
+    finally:
+        metrics.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
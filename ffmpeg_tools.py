@@ -0,0 +1,210 @@
+from jobs import ConversionCancelled
+import subprocess
+import tempfile
+import shutil
+import signal
+import json
+import sys
+import os
+import re
+
+
+# Encoder names offered in the codec dropdowns -> codec name ffprobe reports for the stream they produce
+ENCODER_CODECS = {
+    'libx264': 'h264', 'h264': 'h264', 'libx265': 'hevc', 'mpeg4': 'mpeg4', 'libxvid': 'mpeg4',
+    'libvpx': 'vp8', 'vp8': 'vp8', 'libvpx-vp9': 'vp9', 'vp9': 'vp9', 'prores': 'prores',
+    'flv1': 'flv1', 'mpeg2video': 'mpeg2video', 'libtheora': 'theora', 'h263': 'h263',
+    'png': 'png', 'rawvideo': 'rawvideo', 'gif': 'gif',
+    'pcm_s16le': 'pcm_s16le', 'libmp3lame': 'mp3', 'aac': 'aac', 'libfdk_aac': 'aac', 'alac': 'alac',
+    'libvorbis': 'vorbis', 'flac': 'flac', 'libopus': 'opus', 'opus': 'opus'
+}
+
+# Codecs each output container can carry without re-encoding: (video, audio)
+CONTAINER_CODECS = {
+    'mp4': ({'h264', 'hevc', 'mpeg4', 'vp9', 'av1'}, {'aac', 'mp3', 'alac', 'opus', 'ac3'}),
+    'avi': ({'h264', 'mpeg4', 'png', 'rawvideo'}, {'mp3', 'pcm_s16le', 'ac3'}),
+    'webm': ({'vp8', 'vp9', 'av1'}, {'vorbis', 'opus'}),
+    'mkv': ({'h264', 'hevc', 'mpeg4', 'vp8', 'vp9', 'av1', 'theora', 'mpeg2video', 'prores'},
+            {'aac', 'mp3', 'vorbis', 'opus', 'flac', 'ac3', 'alac', 'pcm_s16le'}),
+    'mov': ({'h264', 'hevc', 'mpeg4', 'prores'}, {'aac', 'mp3', 'alac', 'pcm_s16le'}),
+    'flv': ({'h264', 'flv1'}, {'aac', 'mp3'}),
+    'ts': ({'h264', 'hevc', 'mpeg2video'}, {'aac', 'mp3', 'ac3'}),
+    'ogv': ({'theora'}, {'vorbis', 'opus', 'flac'}),
+    '3gp': ({'h264', 'mpeg4', 'h263'}, {'aac', 'amr_nb'}),
+    'wav': (set(), {'pcm_s16le'}),
+    'mp3': (set(), {'mp3'}),
+    'aac': (set(), {'aac'}),
+    'm4a': (set(), {'aac', 'alac'}),
+    'ogg': (set(), {'vorbis', 'opus', 'flac'}),
+    'flac': (set(), {'flac'}),
+    'opus': (set(), {'opus'})
+}
+
+
+def ffmpeg_binary():
+    # Same lookup as moviepy.config (FFMPEG_BINARY env or the imageio-ffmpeg download),
+    # without importing moviepy/imageio and numpy behind them
+    binary = os.getenv('FFMPEG_BINARY', 'ffmpeg-imageio')
+    if binary == 'ffmpeg-imageio':
+        from imageio_ffmpeg import get_ffmpeg_exe
+        binary = get_ffmpeg_exe()
+    return binary
+
+
+def ffprobe_binary():
+    ffmpeg = ffmpeg_binary()
+    sibling = os.path.join(os.path.dirname(ffmpeg), os.path.basename(ffmpeg).replace('ffmpeg', 'ffprobe'))
+    if os.path.dirname(ffmpeg) and os.path.isfile(sibling):
+        return sibling
+    return shutil.which('ffprobe')
+
+
+def popen_params():
+    # Keep ffmpeg from flashing a console window on Windows
+    return {'creationflags': 0x08000000} if os.name == 'nt' else {}
+
+
+def parse_rate(rate):
+    num, _, den = (rate or '0').partition('/')
+    return float(num) / float(den) if den and float(den) else float(num or 0)
+
+
+def probe(path):
+    # -> {'duration': seconds, 'streams': [{'codec_type', 'codec_name', 'width', 'height', 'fps'}, ...]}
+    ffprobe = ffprobe_binary()
+    if not ffprobe:
+        return probe_with_ffmpeg(path)
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_entries',
+         'stream=codec_type,codec_name,width,height,avg_frame_rate:format=duration', '-of', 'json', path],
+        capture_output=True, text=True, **popen_params()
+    )
+    if result.returncode != 0:
+        raise IOError(f"ffprobe could not read {path}: {result.stderr.strip()}")
+    info = json.loads(result.stdout)
+    streams = [
+        {
+            'codec_type': stream.get('codec_type'),
+            'codec_name': stream.get('codec_name'),
+            'width': stream.get('width', 0),
+            'height': stream.get('height', 0),
+            'fps': parse_rate(stream.get('avg_frame_rate'))
+        }
+        for stream in info.get('streams', [])
+    ]
+    return {'duration': float(info.get('format', {}).get('duration') or 0), 'streams': streams}
+
+
+def probe_with_ffmpeg(path):
+    # Fallback for installs that ship ffmpeg without ffprobe (e.g. imageio-ffmpeg): parse the `ffmpeg -i` banner
+    result = subprocess.run([ffmpeg_binary(), '-hide_banner', '-i', path], capture_output=True, text=True, **popen_params())
+    duration = 0
+    streams = []
+    for line in result.stderr.splitlines():
+        match = re.search(r'Duration: (\d+):(\d+):(\d+\.\d+)', line)
+        if match:
+            hours, minutes, seconds = match.groups()
+            duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        match = re.search(r'Stream #\d+:\d+.*?: (Video|Audio): (\w+)', line)
+        if match:
+            stream = {'codec_type': match.group(1).lower(), 'codec_name': match.group(2), 'width': 0, 'height': 0, 'fps': 0}
+            size = re.search(r', (\d{2,5})x(\d{2,5})', line)
+            if size:
+                stream['width'], stream['height'] = int(size.group(1)), int(size.group(2))
+            fps = re.search(r', ([\d.]+) (?:fps|tbr)', line)
+            if fps:
+                stream['fps'] = float(fps.group(1))
+            streams.append(stream)
+    if not streams:
+        raise IOError(f"ffmpeg could not read {path}")
+    return {'duration': duration, 'streams': streams}
+
+
+def first_stream(info, codec_type):
+    return next((stream for stream in info['streams'] if stream['codec_type'] == codec_type), None)
+
+
+def remux_args(info, output_format, codec, fps, audio=True):
+    # ffmpeg output options for a `-c copy` remux, or None when the streams need re-encoding
+    if fps is not None or output_format not in CONTAINER_CODECS:
+        return None
+    video_codecs, audio_codecs = CONTAINER_CODECS[output_format]
+    target = ENCODER_CODECS.get(codec)
+    video = first_stream(info, 'video')
+    sound = first_stream(info, 'audio')
+    if not video_codecs:
+        if sound is None or sound['codec_name'] != target or target not in audio_codecs:
+            return None
+        return ['-map', '0:a:0', '-vn', '-c:a', 'copy']
+    if video is None or video['codec_name'] != target or target not in video_codecs:
+        return None
+    if not audio or sound is None:
+        return ['-map', '0:v:0', '-an', '-c:v', 'copy']
+    if sound['codec_name'] not in audio_codecs:
+        return None
+    return ['-map', '0:v:0', '-map', '0:a:0', '-c', 'copy']
+
+
+def suspend(process, paused):
+    if os.name == 'nt':
+        import ctypes
+        ntdll = ctypes.windll.ntdll
+        (ntdll.NtSuspendProcess if paused else ntdll.NtResumeProcess)(int(process._handle))
+    else:
+        os.kill(process.pid, signal.SIGSTOP if paused else signal.SIGCONT)
+
+
+def wait_process(process, profile=None):
+    # Reaps process; with a profile (metrics.JobProfile) its exit status, CPU time and peak RSS are added
+    if profile is None:
+        process.wait()
+        return
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        profile.add_process(process.returncode, usage.ru_utime + usage.ru_stime, rss)
+        return
+    process.wait()
+    from metrics import process_usage
+    try:
+        profile.add_process(process.returncode, *process_usage(process))
+    except (OSError, AttributeError):
+        profile.add_process(process.returncode)
+
+
+def run_ffmpeg(args, token=None, on_progress=None, profile=None):
+    # on_progress(progress) gets each `-progress` block as a dict (frame, fps, out_time_us, total_size, progress=continue/end)
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', '-y', *args],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr, **popen_params()
+        )
+        try:
+            progress = {}
+            for line in process.stdout:
+                key, _, value = line.decode(errors='replace').strip().partition('=')
+                progress[key] = value
+                if key != 'progress':
+                    continue
+                if token and token.paused:
+                    suspend(process, True)
+                    token.wait_while_paused()
+                    suspend(process, False)
+                if token and token.cancelled:
+                    raise ConversionCancelled()
+                if on_progress:
+                    on_progress(progress)
+                progress = {}
+            wait_process(process, profile)
+        except BaseException:
+            process.kill()
+            wait_process(process, profile)
+            raise
+        finally:
+            process.stdout.close()
+        if process.returncode != 0:
+            stderr.seek(0)
+            error = stderr.read().decode(errors='replace').strip()
+            raise RuntimeError(f"ffmpeg exited with status {process.returncode}: {error}")
+
@@ -0,0 +1,120 @@
+from video_engine import run_batch, progress_logger
+from ffmpeg_tools import first_stream, run_ffmpeg
+from jobs import partial_path, remove_partial
+import tempfile
+import copy
+import shutil
+import os
+
+
+# Animated outputs made from a video. WebP is usually several times smaller than GIF at the same size
+# and encodes faster, since it isn't limited to one 256-colour palette.
+FORMAT_CODECS = {
+    'gif': ['gif'],
+    'webp': ['libwebp_anim', 'libwebp']
+}
+
+DEFAULT_WIDTH = 480
+DEFAULT_FPS = 15
+DEFAULT_COLORS = 256
+WEBP_QUALITY = 75
+
+# palettegen only emits the palette at the end of the stream, so in a single graph every frame waits in
+# the split filter until then. Clips whose frames would take more than this get two passes instead.
+PALETTE_BUFFER_BUDGET = 512 * 1024**2
+
+
+def frame_filters(job, fps=None, width=None):
+    # -> (filter chain, output fps, output width, output height); never raises the frame rate or upscales
+    video = (first_stream(job.info, 'video') if job.info else None) or {}
+    fps = fps or DEFAULT_FPS
+    if video.get('fps'):
+        fps = min(fps, video['fps'])
+    width = width or DEFAULT_WIDTH
+    if job.width:
+        width = min(width, job.width)
+    height = round(job.height * width / job.width) if job.width else 0
+    return f'fps={fps:g},scale={width}:-1:flags=lanczos', fps, width, height
+
+
+def palette_filters(colors):
+    # stats_mode=diff weights the palette towards what moves; diff_mode=rectangle only redraws the changed area of each frame
+    palettegen = f'palettegen=max_colors={colors}:stats_mode=diff'
+    paletteuse = 'paletteuse=dither=sierra2_4a:diff_mode=rectangle'
+    return palettegen, paletteuse
+
+
+def encode_gif(job, fps=None, width=None, colors=None, logger=None, token=None):
+    filters, fps, width, height = frame_filters(job, fps, width)
+    palettegen, paletteuse = palette_filters(colors or DEFAULT_COLORS)
+    on_progress = progress_logger(job, 'gif', fps, logger)
+    output_args = ['-an', '-sn', '-dn', '-c:v', 'gif', '-loop', '0', job.output_path]
+    if width * height * 4 * fps * job.duration <= PALETTE_BUFFER_BUDGET:
+        # One decode: the frames are split between palettegen and paletteuse
+        graph = f'[0:v:0]{filters},split[a][b];[a]{palettegen}[p];[b][p]{paletteuse}'
+        run_ffmpeg(['-i', job.input_path, '-filter_complex', graph, *output_args], token, on_progress, job.profile)
+        return
+    # Long clips: the palette is built in a first pass and the input decoded a second time
+    directory = tempfile.mkdtemp(prefix='FileConverter-')
+    try:
+        palette_path = os.path.join(directory, 'palette.png')
+        run_ffmpeg(['-i', job.input_path, '-map', '0:v:0', '-vf', f'{filters},{palettegen}', '-frames:v', '1', palette_path],
+                   token, profile=job.profile)
+        graph = f'[0:v:0]{filters}[x];[x][1:v]{paletteuse}'
+        run_ffmpeg(['-i', job.input_path, '-i', palette_path, '-filter_complex', graph, *output_args], token, on_progress, job.profile)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def encode_webp(job, codec, fps=None, width=None, logger=None, token=None):
+    filters, fps, _, _ = frame_filters(job, fps, width)
+    run_ffmpeg(['-i', job.input_path, '-map', '0:v:0', '-vf', filters, '-an', '-sn', '-dn', '-c:v', codec, '-lossless', '0',
+                '-q:v', str(WEBP_QUALITY), '-loop', '0', job.output_path],
+               token, progress_logger(job, 'webp', fps, logger), job.profile)
+
+
+def convert_gif(job, output_format, codec, fps=None, width=None, colors=None, logger=None, token=None, cache=None):
+    # job from video_engine.probe_video
+    if job.info and not first_stream(job.info, 'video'):
+        raise ValueError(f"{job.input_path} has no video stream")
+    profile = job.profile
+    partial = partial_path(job.output_path)
+    key = None
+    if cache and cache.covers(job.input_path):
+        params = {'kind': 'gif', 'format': output_format, 'codec': codec, 'fps': fps, 'width': width, 'colors': colors}
+        with profile.stage('hash'):
+            key = cache.key(job.input_path, params)
+        with profile.stage('write'):
+            profile.cached = cache.fetch(key, partial)
+            if profile.cached:
+                os.replace(partial, job.output_path)
+        if profile.cached:
+            return
+    staged = copy.copy(job)
+    staged.output_path = partial
+    try:
+        with profile.stage('encode'):
+            if output_format == 'gif':
+                encode_gif(staged, fps, width, colors, logger, token)
+            else:
+                encode_webp(staged, codec, fps, width, logger, token)
+        with profile.stage('write'):
+            os.replace(partial, job.output_path)
+    except BaseException:
+        remove_partial(partial)
+        raise
+    if key:
+        with profile.stage('write'):
+            cache.store(key, job.output_path)
+
+
+def convert_gifs(input_paths, output_format, codec, fps=None, width=None, colors=None, output_dir=None, max_jobs=None, on_start=None,
+                 on_done=None, token=None, cache=None, staging=None, journal=None, batch=None, template=None, metrics=None):
+    # fps, width (pixels, height follows the aspect ratio) and colors (GIF palette size, 2-256) default to
+    # DEFAULT_FPS, DEFAULT_WIDTH and DEFAULT_COLORS. Same callbacks and journal handling as video_engine.convert_videos;
+    # the gif encoder and the palette filters run on one thread, so every job counts as one against the CPU budget.
+    settings = {'output_format': output_format, 'codec': codec, 'fps': fps, 'width': width, 'colors': colors,
+                'output_dir': output_dir, 'max_jobs': max_jobs, 'template': template}
+    run_batch('gif', settings, input_paths, output_format, output_dir, template,
+              lambda job, logger: convert_gif(job, output_format, codec, fps, width, colors, logger, token, cache),
+              on_start, on_done, token, staging, journal, batch, metrics, audio_only=True, max_jobs=max_jobs)
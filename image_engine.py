@@ -0,0 +1,355 @@
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from naming import NameReserver, output_paths, release_unused
+from jobs import partial_path, remove_partial
+from journal import RUNNING, DONE, FAILED
+from image_stream import estimate_memory, can_stream, stream_convert
+from image_frames import ANIMATED_FORMATS, save_frames
+from metrics import JobProfile, reset_peak_rss, peak_rss
+import multiprocessing
+import importlib
+import queue
+import time
+import os
+
+
+# Kept apart from main.py so spawned pool workers import only Pillow, not flet/moviepy.
+# Pillow itself is imported on first use, so the window doesn't wait for it.
+
+IMAGE_FORMATS = ["JPEG", "PNG", "GIF", "BMP", "TIFF", "WebP"]
+
+QUALITY_PRESETS = {
+    'Lossless': 100,
+    'High': 90,
+    'Medium': 55,
+    'Low': 25
+}
+
+EFFORT_PRESETS = ['Fast', 'Balanced', 'Small']
+
+# Save options per format for each effort preset: how much encode time to spend on a smaller file.
+# quality only means something to JPEG and WebP and is added by save_options.
+FORMAT_OPTIONS = {
+    'JPEG': {'Fast': {}, 'Balanced': {'optimize': True}, 'Small': {'optimize': True, 'progressive': True}},
+    'PNG': {'Fast': {'compress_level': 1}, 'Balanced': {'compress_level': 6}, 'Small': {'compress_level': 9, 'optimize': True}},
+    'WEBP': {'Fast': {'method': 0}, 'Balanced': {'method': 4}, 'Small': {'method': 6}},
+    'TIFF': {'Fast': {'compression': 'raw'}, 'Balanced': {'compression': 'tiff_lzw'}, 'Small': {'compression': 'tiff_adobe_deflate'}},
+    'GIF': {'Fast': {}, 'Balanced': {}, 'Small': {'optimize': True}},
+    'BMP': {'Fast': {}, 'Balanced': {}, 'Small': {}}
+}
+
+DEFAULT_EFFORT = 'Balanced'
+
+DEFAULT_MEMORY_BUDGET = 1024 * 1024**2  # bytes of decoded pixels one job may hold
+
+
+def warm_up():
+    importlib.import_module('PIL.Image')
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def held_frames_memory(image, image_format, sizes):
+    # Animations Pillow's writers keep whole: APNG holds every frame to diff it against the next one,
+    # and WebP lists the resized copies it is given. RGBA, as both convert most frames to it.
+    target = image_format.upper()
+    frames = getattr(image, 'n_frames', 1)
+    if frames < 2 or target not in ['PNG', 'WEBP']:
+        return 0
+    held = [target_size(size, *image.size) for size in sizes or [None] if target == 'PNG' or size]
+    return max((width * height * 4 * frames for width, height in held), default=0)
+
+
+def job_memory(input_path, image_format, memory_budget, sizes=None):
+    # Memory a conversion is expected to take, read from the header only
+    from PIL import Image
+    try:
+        with Image.open(input_path) as image:
+            needed = estimate_memory(image) + held_frames_memory(image, image_format, sizes)
+            if needed > memory_budget and can_stream(image, image_format):
+                return memory_budget
+            return needed
+    except Exception:
+        return 0  # unreadable: let convert_image report it
+
+
+def save_options(image_format, quality, effort=DEFAULT_EFFORT):
+    target = image_format.upper()
+    options = dict(FORMAT_OPTIONS.get(target, {}).get(effort, {}))
+    if target in ['JPEG', 'WEBP']:
+        options['quality'] = quality
+    if target == 'JPEG':
+        options['subsampling'] = 0 if quality >= 90 else 2  # full chroma (4:4:4) only where it is visible
+    if target == 'WEBP' and quality >= 100:
+        options['lossless'] = True
+    return options
+
+
+def parse_sizes(text):
+    # "2048, 1024, 256" -> [2048, 1024, 256] (longest side); "800x600" -> [(800, 600)] (exact)
+    sizes = []
+    for token in text.replace(',', ' ').split():
+        width, _, height = token.lower().partition('x')
+        if not width.isdigit() or (height and not height.isdigit()):
+            raise ValueError(f"Invalid size: {token}")
+        sizes.append((int(width), int(height)) if height else int(width))
+    return sizes or None
+
+
+def size_suffix(size):
+    return f"_{size[0]}x{size[1]}" if isinstance(size, tuple) else f"_{size}"
+
+
+def target_size(size, width, height):
+    if size is None:
+        return width, height
+    if isinstance(size, tuple):
+        return size
+    scale = min(1, size / max(width, height))  # a longest-side limit never upscales
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def convert_image(input_path, output_path, image_format, quality, cache=None, memory_budget=DEFAULT_MEMORY_BUDGET, on_frame=None,
+                  size=None, effort=DEFAULT_EFFORT):
+    return convert_image_sizes(input_path, [(size, output_path)], image_format, quality, cache, memory_budget, on_frame, effort)[0]
+
+
+def convert_image_sizes(input_path, outputs, image_format, quality, cache=None, memory_budget=DEFAULT_MEMORY_BUDGET, on_frame=None,
+                        effort=DEFAULT_EFFORT, profile=None):
+    # outputs: [(size, output_path)], size as taken by target_size; every output comes from a single decode.
+    # on_frame(frame, frames) reports progress through animations and multi-page files.
+    # profile (metrics.JobProfile) gets the time spent opening, decoding, resizing, encoding and writing.
+    profile = profile or JobProfile('image', input_path)
+    todo = []
+    for size, output_path in outputs:
+        params = {'kind': 'image', 'format': image_format, 'quality': quality, 'size': size, 'effort': effort}
+        with profile.stage('hash'):
+            key = cache.key(input_path, params) if cache and cache.covers(input_path) else None
+        with profile.stage('write'):
+            if key and cache.fetch(key, partial_path(output_path)):
+                os.replace(partial_path(output_path), output_path)
+            else:
+                todo.append((size, output_path, key))
+    if not todo:
+        profile.cached = True
+        return [output_path for _, output_path in outputs]
+    from PIL import Image
+    options = save_options(image_format, quality, effort)
+    try:
+        with profile.stage('probe'):
+            image = Image.open(input_path)
+        with image:
+            animated = getattr(image, 'n_frames', 1) > 1
+            # Each output is written under its partial name and renamed once all of them are complete
+            targets = sorted(((target_size(size, *image.size), partial_path(output_path)) for size, output_path, _ in todo),
+                             key=lambda target: target[0][0] * target[0][1], reverse=True)
+            streamed = targets[0][0] == image.size and len(targets) == 1 and \
+                estimate_memory(image) > memory_budget and can_stream(image, image_format)
+            if animated and image_format.upper() in ANIMATED_FORMATS:
+                # frames are decoded as they are encoded, so it all counts as encode time
+                with profile.stage('encode'):
+                    for target, output_path in targets:
+                        save_frames(image, output_path, image_format, options, on_frame, target if target != image.size else None)
+            elif not streamed:
+                if animated:
+                    profile.notes.append(f"{image_format} holds a single frame, kept the first of {image.n_frames}")
+                # JPEGs decode at 1/2, 1/4 or 1/8 scale when that still covers the largest output
+                image.draft(image.mode, targets[0][0])
+                with profile.stage('decode'):
+                    image.load()
+                source = image
+                for target, output_path in targets:
+                    if target != source.size:
+                        # reducing_gap lets reduce() shrink by whole factors before the resampling pass;
+                        # each smaller output is taken from the previous one
+                        with profile.stage('resize'):
+                            source = source.resize(target, Image.LANCZOS, reducing_gap=2.0)
+                    with profile.stage('encode'):
+                        source.save(output_path, format=image_format, **options)
+        if streamed:
+            # Too large to decode whole within the budget: decode and write a band of rows at a time
+            with profile.stage('encode'):
+                stream_convert(input_path, targets[0][1], image_format, memory_budget, options.get('compress_level', 6))
+        with profile.stage('write'):
+            for _, output_path, _ in todo:
+                os.replace(partial_path(output_path), output_path)
+    except BaseException:
+        remove_partial(*[partial_path(output_path) for _, output_path, _ in todo])
+        raise
+    with profile.stage('write'):
+        for _, output_path, key in todo:
+            if key:
+                cache.store(key, output_path)
+    return [output_path for _, output_path in outputs]
+
+
+# Set in each pool worker when the caller wants frame progress
+progress_queue = None
+
+
+def set_progress_queue(frames_queue):
+    global progress_queue
+    progress_queue = frames_queue
+
+
+def convert_image_in_pool(input_path, outputs, image_format, quality, cache, memory_budget, effort, source_path=None):
+    # source_path: the file input_path was prefetched from, which progress is reported under.
+    # -> the job's JobProfile, with this worker's peak memory while it ran
+    on_frame = None
+    if progress_queue:
+        on_frame = lambda frame, frames: progress_queue.put((source_path or input_path, frame, frames))
+    profile = JobProfile('image', source_path or input_path)
+    reset_peak_rss()
+    convert_image_sizes(input_path, outputs, image_format, quality, cache, memory_budget, on_frame, effort, profile)
+    profile.note_rss(peak_rss())
+    return profile
+
+
+def submit_staged(executor, pipeline, input_path, outputs, *args):
+    # -> (future, outputs as the worker writes them): with a pipeline, a prefetched input and scratch outputs
+    if not pipeline:
+        return executor.submit(convert_image_in_pool, input_path, outputs, *args), outputs
+    try:
+        local_input = pipeline.fetch(input_path)
+    except OSError as e:
+        future = Future()
+        future.set_exception(e)
+        return future, outputs
+    scratch = [(size, pipeline.scratch_path(output_path)) for size, output_path in outputs]
+    return executor.submit(convert_image_in_pool, local_input, scratch, *args, input_path), scratch
+
+
+def report_frames(frames_queue, on_progress):
+    while True:
+        try:
+            on_progress(*frames_queue.get_nowait())
+        except queue.Empty:
+            return
+
+
+def convert_images(input_paths, image_format, quality, workers=None, output_dir=None, on_done=None, token=None, cache=None,
+                   memory_budget=None, on_progress=None, sizes=None, effort=None, staging=None, journal=None, batch=None, template=None,
+                   metrics=None, on_note=None):
+    # on_done(input_path, output_path, error) is called in the calling thread for each output as
+    # its file finishes, in completion order. With several sizes, each output name gets the size
+    # as a suffix (photo_1024.webp). memory_budget is per job; jobs start while their
+    # estimated memory fits in workers * memory_budget, so a few huge images don't run side by side.
+    # on_progress(input_path, frame, frames) is called in the calling thread while animations encode,
+    # on_note(input_path, message) for what isn't an error but loses something (frames of an animation).
+    # staging (pipeline.Staging) reads inputs ahead into local scratch and writes outputs back behind.
+    # journal, batch, template and metrics as in video_engine.convert_videos.
+    workers = workers or default_workers()
+    memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET
+    effort = effort or DEFAULT_EFFORT
+    sizes = sizes or [None]
+
+    def plan():
+        reserver = NameReserver()
+        names = [output_paths(input_paths, image_format, output_dir, size_suffix(size) if len(sizes) > 1 else '', template, reserver)
+                 for size in sizes]
+        return [(input_path, [(size, paths[index][1]) for size, paths in zip(sizes, names)]) for index, input_path in enumerate(input_paths)]
+
+    settings = {'image_format': image_format, 'quality': quality, 'workers': workers, 'output_dir': output_dir,
+                'memory_budget': memory_budget, 'sizes': sizes, 'effort': effort, 'template': template}
+    batch, pending = journal.begin('image', settings, plan, batch) if journal else (None, plan())
+    # WxH sizes come back from the journal as lists
+    pending = [(input_path, [(tuple(size) if isinstance(size, list) else size, output_path) for size, output_path in outputs])
+               for input_path, outputs in pending]
+    planned = [output_path for _, outputs in pending for _, output_path in outputs]
+    pipeline = staging.start([input_path for input_path, _ in pending]) if staging else None
+    pending.reverse()
+    free_memory = workers * memory_budget
+    memory = {}
+    frames_queue = multiprocessing.Queue() if on_progress else None
+    profiles = {}  # input path -> JobProfile, from submit to report
+    handed_over = {}  # input path -> when its outputs went to the write-back queue
+
+    def report(input_path, outputs, error):
+        if journal:
+            journal.update(batch, input_path, FAILED if error else DONE, error)
+        profile = profiles.pop(input_path, None)
+        if on_note and profile:
+            for note in profile.notes:
+                on_note(input_path, note)
+        if metrics and profile:
+            if input_path in handed_over:
+                profile.add('write', time.perf_counter() - handed_over.pop(input_path))
+            metrics.record(profile.record([output_path for _, output_path in outputs], error))
+        if on_done:
+            for _, output_path in outputs:
+                on_done(input_path, output_path, error)
+
+    def write_back(input_path, outputs, written):
+        moves = [(scratch_path, output_path) for (_, scratch_path), (_, output_path) in zip(written, outputs)]
+        handed_over[input_path] = time.perf_counter()
+        return pipeline.write_back(input_path, moves)
+
+    def worker_done(input_path, future):
+        if not future.exception():
+            profiles[input_path].merge(future.result())
+        return future.exception()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_progress_queue, initargs=(frames_queue,)) as executor:
+            futures = {}
+            writing = {}
+            while pending or futures or writing:
+                if token and token.cancelled:
+                    break
+                if token and not futures:
+                    token.wait_while_paused()
+                # Only a couple of files per worker are queued at a time, so pause and cancel take effect between files
+                while pending and len(futures) < workers * 2 and not (token and (token.paused or token.cancelled)):
+                    input_path, outputs = pending[-1]
+                    if input_path not in memory:
+                        memory[input_path] = job_memory(input_path, image_format, memory_budget, [size for size, _ in outputs])
+                    if futures and memory[input_path] > free_memory:
+                        break
+                    if pipeline and futures and not pipeline.ready(input_path):
+                        break  # still being read ahead; the workers have enough to do meanwhile
+                    pending.pop()
+                    free_memory -= memory[input_path]
+                    if journal:
+                        journal.update(batch, input_path, RUNNING)
+                    profiles[input_path] = JobProfile('image', input_path)
+                    future, written = submit_staged(executor, pipeline, input_path, outputs,
+                                                    image_format, quality, cache, memory_budget, effort)
+                    futures[future] = (input_path, outputs, written)
+                if not futures and not writing:
+                    continue
+                polling = frames_queue or (pipeline and pending)
+                finished, _ = wait([*futures, *writing], timeout=0.1 if polling else None, return_when=FIRST_COMPLETED)
+                if frames_queue:
+                    report_frames(frames_queue, on_progress)
+                for future in finished:
+                    if future in writing:
+                        report(*writing.pop(future), future.exception())
+                        continue
+                    input_path, outputs, written = futures.pop(future)
+                    free_memory += memory[input_path]
+                    error = worker_done(input_path, future)
+                    if pipeline and not error:
+                        writing[write_back(input_path, outputs, written)] = (input_path, outputs)
+                        continue
+                    if pipeline:
+                        pipeline.discard(input_path, [scratch_path for _, scratch_path in written])
+                    report(input_path, outputs, error)
+            for future in futures:
+                input_path, outputs, written = futures[future]
+                error = worker_done(input_path, future)
+                if pipeline and not error:
+                    error = write_back(input_path, outputs, written).exception()
+                elif pipeline:
+                    pipeline.discard(input_path, [scratch_path for _, scratch_path in written])
+                report(input_path, outputs, error)
+            for future in writing:
+                report(*writing[future], future.exception())
+    finally:
+        if pipeline:
+            pipeline.close()
+        release_unused(*planned)
+    if journal:
+        journal.finish(batch)  # completed or cancelled; only a batch cut short stays behind for resume
+    if token:
+        token.check()
@@ -0,0 +1,68 @@
+import threading
+
+
+# Animated GIF/WebP/APNG and multi-page TIFF. Frames are pulled from the source one at a time
+# as Pillow's save_all asks for them, so the decoded animation is never held as a list here.
+
+ANIMATED_FORMATS = ['GIF', 'WEBP', 'TIFF', 'PNG']
+
+GIF_COLORS = 256
+
+
+def frame_copies(image, size=None, colors=None):
+    from PIL import Image, ImageSequence
+    for frame in ImageSequence.Iterator(image):
+        frame = frame.resize(size, Image.LANCZOS) if size and size != frame.size else frame.copy()
+        if not colors and frame.mode == 'P':
+            # GIFs decode their first frame as P and the rest as RGB(A); other writers expect one mode
+            frame = frame.convert('RGBA' if 'transparency' in frame.info else 'RGB')
+        if colors and frame.mode == 'RGB':
+            # Pillow would convert RGB frames with median cut; fast octree is several times quicker
+            frame = frame.quantize(colors, method=Image.Quantize.FASTOCTREE)
+        yield frame
+
+
+def frame_durations(image):
+    # WebP takes per-frame durations only as a list up front; GIF and APNG read them from each frame
+    from PIL import ImageSequence
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        frame.load()  # a WebP source sets a frame's duration as it decodes it
+        durations.append(frame.info.get('duration', 0))
+    image.seek(0)
+    return durations
+
+
+def watch_frames(image, frames, on_frame, done):
+    # save_all seeks the source through its frames, so its position is the encoder's progress
+    while not done.wait(0.1):
+        on_frame(image.tell() + 1, frames)
+
+
+def save_frames(image, output_path, image_format, options, on_frame=None, size=None, colors=GIF_COLORS):
+    target = image_format.upper()
+    frames = image.n_frames
+    options = {**options, 'save_all': True}
+    if 'loop' in image.info:
+        options['loop'] = image.info['loop']
+    elif target != 'GIF':
+        options['loop'] = 1  # a GIF without a loop extension plays once
+    if target == 'WEBP':
+        options['duration'] = frame_durations(image)
+
+    done = threading.Event()
+    if on_frame:
+        threading.Thread(target=watch_frames, args=(image, frames, on_frame, done), daemon=True).start()
+    try:
+        if target == 'GIF' or size:
+            sequence = frame_copies(image, size, colors if target == 'GIF' else None)
+            first = next(sequence)
+            if target == 'PNG':
+                sequence = list(sequence)  # the APNG writer walks append_images twice (image_engine.held_frames_memory)
+            first.save(output_path, format=image_format, append_images=sequence, **options)
+        else:
+            image.save(output_path, format=image_format, **options)
+    finally:
+        done.set()
+    if on_frame:
+        on_frame(frames, frames)
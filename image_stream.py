@@ -0,0 +1,127 @@
+import struct
+import zlib
+
+
+# Band-by-band conversion for images too large to decode at once. Inputs whose pixels are
+# stored uncompressed (raw TIFF strips/tiles, BMP) can be decoded a band of rows at a
+# time by pointing Pillow's raw decoder at the band's byte range; PNG and BMP outputs are
+# written a band at a time. Everything else goes through the normal Image.open/save path.
+
+RAW_BYTES = {'1': None, 'L': 1, 'P': 1, 'LA': 2, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'BGRA': 4, 'RGBX': 4, 'BGRX': 4, 'CMYK': 4}
+
+# Output mode each writer stores, by source mode; anything else is converted to RGB
+PNG_MODES = {'L': 'L', '1': 'L', 'LA': 'LA', 'RGB': 'RGB', 'RGBA': 'RGBA', 'PA': 'RGBA'}
+BMP_MODES = {'L': 'L', '1': 'L', 'RGB': 'RGB', 'RGBA': 'RGBA', 'LA': 'RGBA', 'PA': 'RGBA'}
+
+
+def bytes_per_pixel(mode):
+    if mode in ['I', 'F']:
+        return 4
+    if mode.startswith('I;16'):
+        return 2
+    return max(1, len(mode)) if mode != '1' else 1
+
+
+def estimate_memory(image):
+    # Decoded bitmap plus the converted copy most saves make
+    return image.width * image.height * bytes_per_pixel(image.mode) * 2
+
+
+def can_stream(image, image_format):
+    if image_format.upper() not in ['PNG', 'BMP'] or getattr(image, 'n_frames', 1) > 1:
+        return False
+    for tile in image.tile:
+        codec, _, _, args = tile
+        if codec != 'raw' or not isinstance(args, tuple) or len(args) < 3:
+            return False
+        rawmode, stride, _ = args[:3]
+        if RAW_BYTES.get(rawmode) is None and not stride:
+            return False
+    return True
+
+
+def band_tiles(image, top, bottom):
+    tiles = []
+    for codec, (x0, y0, x1, y1), offset, args in image.tile:
+        start, end = max(top, y0), min(bottom, y1)
+        if start >= end:
+            continue
+        rawmode, stride, orientation = args[:3]
+        stride = stride or (x1 - x0) * RAW_BYTES[rawmode]
+        # bottom-up rasters (BMP) store the last row first
+        skipped = start - y0 if orientation > 0 else y1 - end
+        tiles.append((codec, (x0, start - top, x1, end - top), offset + skipped * stride, args))
+    return tiles
+
+
+def iter_bands(path, rows, mode):
+    from PIL import Image
+    with Image.open(path) as image:
+        width, height = image.size
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        # opened from a file object so Pillow reads the band instead of mapping the whole file
+        with open(path, 'rb') as file, Image.open(file) as band:
+            band.tile = band_tiles(band, top, bottom)
+            band._size = (width, bottom - top)
+            if hasattr(band, '_tile_size'):
+                band._tile_size = band._size  # TIFF allocates its canvas from this
+            band.load()
+            yield band if band.mode == mode else band.convert(mode)
+
+
+def png_chunk(file, kind, data):
+    file.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+
+def write_png(output_path, width, height, mode, bands, compress_level=6):
+    color_type = {'L': 0, 'LA': 4, 'RGB': 2, 'RGBA': 6}[mode]
+    row_bytes = width * len(mode)
+    compressor = zlib.compressobj(compress_level)
+    with open(output_path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        png_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+        for band in bands:
+            data = band.tobytes()
+            # filter type 0 on every row: per-row adaptive filtering is too slow in pure Python
+            rows = b''.join(b'\x00' + data[start:start + row_bytes] for start in range(0, len(data), row_bytes))
+            compressed = compressor.compress(rows)
+            if compressed:
+                png_chunk(file, b'IDAT', compressed)
+        png_chunk(file, b'IDAT', compressor.flush())
+        png_chunk(file, b'IEND', b'')
+
+
+def write_bmp(output_path, width, height, mode, bands):
+    bits = {'L': 8, 'RGB': 24, 'RGBA': 32}[mode]
+    rawmode = {'L': 'L', 'RGB': 'BGR', 'RGBA': 'BGRA'}[mode]
+    row_bytes = width * bits // 8
+    padding = b'\x00' * ((4 - row_bytes % 4) % 4)
+    palette = b''.join(bytes((i, i, i, 0)) for i in range(256)) if mode == 'L' else b''
+    offset = 14 + 40 + len(palette)
+    image_size = (row_bytes + len(padding)) * height
+    with open(output_path, 'wb') as file:
+        file.write(b'BM' + struct.pack('<IHHI', offset + image_size, 0, 0, offset))
+        # negative height: rows are stored top-down, so bands can be written in order
+        file.write(struct.pack('<IiiHHIIiiII', 40, width, -height, 1, bits, 0, image_size, 2835, 2835, 256 if palette else 0, 0))
+        file.write(palette)
+        for band in bands:
+            data = band.tobytes('raw', rawmode)
+            if padding:
+                data = b''.join(data[start:start + row_bytes] + padding for start in range(0, len(data), row_bytes))
+            file.write(data)
+
+
+def stream_convert(input_path, output_path, image_format, memory_budget, compress_level=6):
+    from PIL import Image
+    with Image.open(input_path) as image:
+        width, height, source_mode = image.width, image.height, image.mode
+    is_png = image_format.upper() == 'PNG'
+    mode = (PNG_MODES if is_png else BMP_MODES).get(source_mode, 'RGB')
+    # a band is held decoded, converted, as bytes and as the row-joined copy
+    rows = max(1, memory_budget // (width * bytes_per_pixel(source_mode) * 4))
+    bands = iter_bands(input_path, rows, mode)
+    if is_png:
+        write_png(output_path, width, height, mode, bands, compress_level)
+    else:
+        write_bmp(output_path, width, height, mode, bands)
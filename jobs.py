@@ -0,0 +1,114 @@
+import threading
+import queue
+import os
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+class CancelToken():
+    # A token made with a parent also pauses and cancels with it, while cancelling the child
+    # leaves the parent running: sibling pieces of one job can be stopped when one of them fails
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.cancel_event = threading.Event()
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set() or bool(self.parent and self.parent.cancelled)
+
+    @property
+    def paused(self):
+        return not self.resume_event.is_set() or bool(self.parent and self.parent.paused)
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.resume_event.set()
+
+    def pause(self):
+        if not self.cancelled:
+            self.resume_event.clear()
+
+    def resume(self):
+        self.resume_event.set()
+
+    def wait_while_paused(self):
+        self.resume_event.wait()
+        if self.parent and not self.cancel_event.is_set():
+            self.parent.wait_while_paused()
+
+    def check(self):
+        # Called by engines between units of work: blocks while paused, raises once cancelled.
+        self.wait_while_paused()
+        if self.cancelled:
+            raise ConversionCancelled()
+
+
+def partial_path(output_path):
+    # Name an output is written under until it is complete, then renamed into place, so a crash never
+    # leaves a truncated file under the real name; the extension stays last for encoders that go by it
+    root, extension = os.path.splitext(output_path)
+    return f"{root}.part{extension}"
+
+
+def remove_partial(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class JobRunner():
+    # One background thread per panel working through queued batches, so the
+    # Flet click handler returns immediately and batches can be paused or cancelled.
+    # Pause and cancel go to the runner's token, which outlives single batches: each batch runs
+    # under a child of it, so a click between two batches or before the first starts still counts.
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.token = CancelToken()
+        self.cancels = 0  # batches queued before the latest cancel are dropped
+        self.thread = None
+
+    def submit(self, job):
+        # job(token) runs on the runner thread
+        with self.lock:
+            self.queue.put((job, self.cancels))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            job, cancels = self.queue.get()
+            with self.lock:
+                if cancels != self.cancels:
+                    self.queue.task_done()
+                    continue
+                if self.token.cancelled:
+                    self.token = CancelToken()  # submitted after the cancel
+                token = CancelToken(self.token)
+            try:
+                job(token)
+            except ConversionCancelled:
+                pass
+            except Exception as e:
+                print(f"Error running conversion: {e}")
+            finally:
+                self.queue.task_done()
+
+    def cancel(self):
+        # Drops queued batches as well as the one in progress
+        with self.lock:
+            self.cancels += 1
+            self.token.cancel()
+
+    def pause(self):
+        self.token.pause()
+
+    def resume(self):
+        self.token.resume()
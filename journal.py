@@ -0,0 +1,136 @@
+from cache import default_cache_dir
+import threading
+import sqlite3
+import json
+import time
+import sys
+import os
+
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def process_alive(pid):
+    # os.kill(pid, 0) would terminate the process on Windows, so it is asked through OpenProcess there
+    if pid == os.getpid():
+        return True
+    if sys.platform == 'win32':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.GetLastError() == 5  # access denied: it exists
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # another user's
+    return True
+
+
+def default_journal_path():
+    # In its own folder, so cache eviction never counts or removes it
+    return os.path.join(default_cache_dir(), 'journal', 'journal.sqlite3')
+
+
+class JobJournal():
+    # Durable record of every batch while it runs, so a batch cut short by a crash or by closing
+    # the app can be resumed with the same output names. A batch is deleted once it completes or is cancelled.
+    # Each job row is one input with its outputs (JSON, as the engine planned them) and a state.
+    # Every batch records the pid of the process running it. Only batches whose process is gone are
+    # offered for resume, and resuming one claims it first, so two processes never run the same batch.
+    def __init__(self, path=None):
+        self.path = path or default_journal_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY, kind TEXT NOT NULL, settings TEXT NOT NULL, created REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS jobs (
+                batch INTEGER NOT NULL REFERENCES batches(id) ON DELETE CASCADE, input_path TEXT NOT NULL,
+                outputs TEXT NOT NULL, state TEXT NOT NULL, error TEXT, PRIMARY KEY (batch, input_path));
+        ''')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(batches)')]
+        if 'owner' not in columns:
+            # journals from before owners were recorded: their batches count as abandoned
+            self.connection.execute('ALTER TABLE batches ADD COLUMN owner INTEGER')
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def start(self, kind, settings, jobs):
+        # jobs: [(input_path, outputs)] -> batch id
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                cursor = self.connection.execute('INSERT INTO batches (kind, settings, created, owner) VALUES (?, ?, ?, ?)',
+                                                 (kind, json.dumps(settings), time.time(), os.getpid()))
+                batch = cursor.lastrowid
+                self.connection.executemany('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL)',
+                                            [(batch, input_path, json.dumps(outputs), PENDING) for input_path, outputs in jobs])
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return batch
+
+    def begin(self, kind, settings, plan, batch=None):
+        # -> (batch, [(input_path, outputs)]): a new batch with the jobs from plan(), or, when resuming,
+        # what is left of an earlier one under the output names it was given then
+        if batch is not None:
+            return batch, self.jobs(batch)
+        jobs = plan()
+        return self.start(kind, settings, jobs), jobs
+
+    def update(self, batch, input_path, state, error=None):
+        self.execute('UPDATE jobs SET state = ?, error = ? WHERE batch = ? AND input_path = ?',
+                     (state, str(error) if error else None, batch, input_path))
+
+    def jobs(self, batch):
+        # Jobs still to do in a batch, in the order they were planned: [(input_path, outputs)]
+        rows = self.execute('SELECT input_path, outputs FROM jobs WHERE batch = ? AND state != ? ORDER BY rowid', (batch, DONE))
+        return [(input_path, json.loads(outputs)) for input_path, outputs in rows]
+
+    def unfinished(self, kind=None):
+        # -> [(batch, kind, settings, jobs left)], oldest first, of the batches no running process owns
+        rows = self.execute('''
+            SELECT batches.id, kind, settings, owner, COUNT(*) FROM batches JOIN jobs ON jobs.batch = batches.id
+            WHERE state != ? AND (? IS NULL OR kind = ?) GROUP BY batches.id ORDER BY batches.id
+        ''', (DONE, kind, kind))
+        return [(batch, kind, json.loads(settings), count) for batch, kind, settings, owner, count in rows
+                if owner is None or not process_alive(owner)]
+
+    def claim(self, batch):
+        # -> True once this process owns batch: it already did, or its owner is gone and no other process
+        # claimed it first. Call before resuming or cleaning up a batch from unfinished().
+        rows = self.execute('SELECT owner FROM batches WHERE id = ?', (batch,))
+        if not rows:
+            return False  # finished meanwhile
+        owner = rows[0][0]
+        if owner == os.getpid():
+            return True
+        if owner is not None and process_alive(owner):
+            return False
+        with self.lock:
+            cursor = self.connection.execute('UPDATE batches SET owner = ? WHERE id = ? AND owner IS ?', (os.getpid(), batch, owner))
+        return cursor.rowcount == 1
+
+    def finish(self, batch):
+        with self.lock:
+            self.connection.execute('DELETE FROM jobs WHERE batch = ?', (batch,))
+            self.connection.execute('DELETE FROM batches WHERE id = ?', (batch,))
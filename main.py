@@ -1,23 +1,28 @@
 from proglog import ProgressBarLogger
-from PIL import Image
-import moviepy.editor as moviepy
+from image_engine import IMAGE_FORMATS, QUALITY_PRESETS, EFFORT_PRESETS, DEFAULT_EFFORT, DEFAULT_MEMORY_BUDGET, convert_images, default_workers, parse_sizes, warm_up as image_warm_up
+from video_engine import AUDIO_FORMATS, PRESETS, FORMAT_CODECS as VIDEO_FORMAT_CODECS, convert_videos, warm_up as video_warm_up
+from gif_engine import FORMAT_CODECS as GIF_FORMAT_CODECS, DEFAULT_WIDTH as GIF_WIDTH, DEFAULT_COLORS as GIF_COLORS, convert_gifs
+from audio_engine import FORMAT_CODECS as AUDIO_FORMAT_CODECS, convert_audios
+from jobs import ConversionCancelled, JobRunner
+from cache import ConversionCache
+from journal import JobJournal
+from metrics import MetricsLog
+from naming import Destination, DEFAULT_TEMPLATE, check_template
+from pipeline import Staging, DEFAULT_DEPTH
+import multiprocessing
+import threading
 import flet as ft
+import time
 import os
  
  
  
-def generate_unique_filename(base_path, extension):
-        counter = 1
-        unique_path = f"{base_path}.{extension}"
-        while os.path.exists(unique_path):
-            unique_path = f"{base_path} ({counter}).{extension}"
-            counter += 1
-        return unique_path 
+PROGRESS_MAX_RATE = 10  # Hz
 
 
 class snack():
-    def __init__(self, text: str, page: ft.Page):
-        snack_bar = ft.SnackBar(ft.Text(text))
+    def __init__(self, text: str, page: ft.Page, action: str = None, on_action=None, duration: int = 4000):
+        snack_bar = ft.SnackBar(ft.Text(text), action=action, on_action=on_action, duration=duration)
         page.overlay.append(snack_bar)
         snack_bar.open = True 
 
@@ -62,36 +67,149 @@ class FilePicker(ft.Row):
             size /= 1024
 
 
+class JobControls(ft.Row):
+    def __init__(self, page: ft.Page, runner: JobRunner):
+        super().__init__()
+        self.page = page
+        self.runner = runner
+        self.pause_button = ft.ElevatedButton('Pause', icon=ft.icons.PAUSE, on_click=self.pause_click, disabled=True)
+        self.cancel_button = ft.ElevatedButton('Cancel', icon=ft.icons.CANCEL, on_click=self.cancel_click, disabled=True)
+        self.controls = [self.pause_button, self.cancel_button]
+
+    def set_running(self, running: bool):
+        self.pause_button.disabled = not running
+        self.cancel_button.disabled = not running
+        self.pause_button.text = 'Pause'
+        self.pause_button.icon = ft.icons.PAUSE
+
+    def pause_click(self, event):
+        if self.runner.token.paused:
+            self.runner.resume()
+            self.pause_button.text = 'Pause'
+            self.pause_button.icon = ft.icons.PAUSE
+        else:
+            self.runner.pause()
+            self.pause_button.text = 'Resume'
+            self.pause_button.icon = ft.icons.PLAY_ARROW
+        self.page.update()
+
+    def cancel_click(self, event):
+        self.runner.cancel()
+        self.set_running(False)
+        snack('Conversion cancelled', self.page)
+        self.page.update()
+
+
 class CustomBarLogger(ProgressBarLogger):
-    def __init__(self, page: ft.Page, progress_bar: ft.ProgressBar, progress_label: ft.Text, file_name: str):
+    def __init__(self, page: ft.Page, progress_bar: ft.ProgressBar, progress_label: ft.Text, file_name: str, token=None, max_rate=PROGRESS_MAX_RATE):
         super().__init__()
         self.page = page
         self.file_name = file_name
         self.progress_bar = progress_bar
         self.progress_label = progress_label
+        self.token = token
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.last_update = 0
+        self.start_time = time.monotonic()
+        self.bar_starts = {}
 
     def callback(self, **changes):
+        if self.token:
+            self.token.check()  # pausing blocks moviepy's frame loop here, cancelling unwinds it
+        now = time.monotonic()
         bars = self.state.get('bars', {})
+        for bar_name, bar_data in bars.items():
+            self.bar_starts.setdefault(bar_name, (now, bar_data.get('index', 0)))
+        # proglog ticks once per frame; coalesce them so a long video doesn't send thousands of diffs to the client
+        if now - self.last_update < self.min_interval and not changes.get('final'):
+            return
+        self.last_update = now
+
         for bar_name, bar_data in bars.items():
             index = bar_data.get('index', 0)
             total = bar_data.get('total', 1)
             percentage = max(0, min(1, index / total if total > 0 else 0))  # Ensure percentage is between 0 and 1
             if not (bar_name == 'chunk' and percentage == 1):
                 self.progress_bar.value = percentage
-                self.progress_label.value = f"Converting {self.file_name + ('Audio' if bar_name == 'chunk' else 'Video')}: {percentage*100:.2f}%"
-            self.page.update()
+                self.progress_label.value = f"Converting {self.file_name + ('Audio' if bar_name == 'chunk' else 'Video')}: {percentage*100:.2f}%{self.stats(bar_name, index, total, now)}"
+        # Only the progress controls are sent, and only while the panel is on the page
+        if self.progress_bar.page:
+            self.page.update(self.progress_bar, self.progress_label)
+
+    def stats(self, bar_name, index, total, now):
+        start_time, start_index = self.bar_starts[bar_name]
+        elapsed = now - start_time
+        if elapsed <= 0 or index <= start_index:
+            return ''
+        rate = (index - start_index) / elapsed
+        text = f" | {rate:.1f} fps" if bar_name != 'chunk' else ''
+        # Bytes written as ffmpeg reports them, since with staging the output grows in a scratch folder
+        if self.state.get('written'):
+            text += f" | {self.state['written'] / (now - self.start_time) / 1024**2:.2f} MB/s"
+        if not total:
+            return text
+        eta = int((total - index) / rate)
+        return text + f" | ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
 
     def bars_callback(self, bar, attr, value, old_value):
-        self.callback()
+        total = self.bars[bar].get('total') or 0
+        self.callback(final=attr == 'index' and value >= total)
+
+
+def offer_resume(panel, resumers):
+    # Once per session, when the panel is first shown: batches of the panel's kinds that were cut short
+    # (crash, app closed mid-batch) can be picked up where they stopped, under the same output names.
+    # resumers: {journal kind: convert_files(token, paths, settings, batch)}, which reruns the panel's
+    # conversion from the journal's settings.
+    if panel.resume_offered:
+        return
+    panel.resume_offered = True
+    unfinished = [batch for kind in resumers for batch in panel.journal.unfinished(kind)]
+    if not unfinished:
+        return
+
+    def resume(event):
+        for batch, kind, settings, _ in unfinished:
+            if not panel.journal.claim(batch):
+                continue  # another converter took it over since the offer was made
+            paths = [input_path for input_path, _ in panel.journal.jobs(batch)]
+            convert_files = resumers[kind]
+            panel.runner.submit(lambda token, paths=paths, settings=settings, batch=batch, convert_files=convert_files:
+                                convert_files(token, paths, settings, batch))
+
+    counts = {}
+    for _, kind, _, count in unfinished:
+        counts[kind] = counts.get(kind, 0) + count
+    files = ' and '.join(f"{count} {kind} file{'s' if count > 1 else ''}" for kind, count in counts.items())
+    snack(f"{files} left unfinished by an earlier session", panel.page, 'Resume', resume, 10000)
+    panel.page.update()
 
 
 class VideoConverter(ft.Column):
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, cache: ConversionCache, staging: Staging, journal: JobJournal, destination: Destination,
+                 metrics: MetricsLog):
         super().__init__()
         self.page = page
+        self.cache = cache
+        self.staging = staging
+        self.journal = journal
+        self.destination = destination
+        self.metrics = metrics
+        self.resume_offered = False
         self.create_elements()
         self.setup_layout()
 
+    def did_mount(self):
+        # Backends are imported when the panel is first shown, not at startup
+        threading.Thread(target=video_warm_up, daemon=True).start()
+        offer_resume(self, {
+            'video': lambda token, paths, settings, batch: self.convert_files(
+                token, paths, settings['output_format'], settings['codec'], settings['fps'], settings['audio'],
+                settings['encoder_options'], settings['threads'], settings.get('segments'), batch),
+            'gif': lambda token, paths, settings, batch: self.convert_animations(
+                token, paths, settings['output_format'], settings['codec'], settings['fps'], settings['width'], settings['colors'], batch)
+        })
+
     def create_elements(self):
         self.convert_label = ft.Text('Convert to: ', style=ft.TextStyle(size=22))
         self.format_dd = self.create_format_dropdown()
@@ -99,12 +217,28 @@ class VideoConverter(ft.Column):
         self.fps_dd = self.create_fps_dropdown()
         self.user_fps = self.create_user_fps_textfield()
         self.audio_switch = self.create_audio_switch()
+        self.preset_dd = self.create_preset_dropdown()
+        self.crf_field = self.create_number_textfield('CRF')
+        self.bitrate_field = self.create_number_textfield('Bitrate')
+        self.threads_field = self.create_number_textfield('Threads')
+        self.segments_field = self.create_number_textfield('Segments')
+        self.segments_field.tooltip = 'Cut long videos into this many pieces and encode them side by side'
+        self.width_field = self.create_number_textfield('Width')
+        self.width_field.hint_text = str(GIF_WIDTH)
+        self.colors_field = self.create_number_textfield('Colors')
+        self.colors_field.hint_text = str(GIF_COLORS)
+        self.colors_field.tooltip = 'GIF palette size, 2-256'
+        self.animation_fields = [self.width_field, self.colors_field]
+        self.encoder_fields = [self.preset_dd, self.crf_field, self.bitrate_field, self.threads_field, self.segments_field]
+        for field in self.animation_fields:
+            field.visible = False
         self.progress_bar_overall_label = ft.Text(value="Overall Progress", visible=False)
         self.progress_bar_overall = self.create_progress_bar(label="Overall Progress")
-        self.progress_bar_file_label = ft.Text(value="", visible=False)
-        self.progress_bar_file = self.create_progress_bar(label="File Progress")
+        self.jobs_column = ft.Column(visible=False, spacing=2)
         self.file_picker = FilePicker(self.page, ft.FilePickerFileType.VIDEO)
         self.convert_button = ft.ElevatedButton('Convert', icon=ft.icons.TASK_ALT, on_click=self.convert, disabled=True)
+        self.runner = JobRunner()
+        self.job_controls = JobControls(self.page, self.runner)
 
     def setup_layout(self):
         format_row = ft.Row([
@@ -116,23 +250,34 @@ class VideoConverter(ft.Column):
         fps_row = ft.Row([
             self.fps_dd,
             self.user_fps,
-            self.audio_switch
+            self.audio_switch,
+            self.width_field,
+            self.colors_field
+        ])
+
+        encoder_row = ft.Row([
+            self.preset_dd,
+            self.crf_field,
+            self.bitrate_field,
+            self.threads_field,
+            self.segments_field
         ])
         
         convert_row = ft.Row([
-            self.convert_button
+            self.convert_button,
+            self.job_controls
         ])
 
         title_label = LabelTitle('Video files converter')
 
-        self.controls = [title_label, self.file_picker, format_row, fps_row, convert_row, self.progress_bar_overall_label, self.progress_bar_overall, self.progress_bar_file_label, self.progress_bar_file]
+        self.controls = [title_label, self.file_picker, format_row, fps_row, encoder_row, convert_row, self.progress_bar_overall_label, self.progress_bar_overall, self.jobs_column]
 
     def create_format_dropdown(self) -> ft.Dropdown:
         return ft.Dropdown(
             width=150,
             label='Format',
             border_radius=10,
-            options=[ft.dropdown.Option(fmt) for fmt in ['mp4', 'avi', 'webm', 'mkv', 'mov', 'flv', 'ts', 'ogv', '3gp', 'gif', 'wav', 'mp3', 'aac', 'm4a', 'ogg', 'flac', 'opus']],
+            options=[ft.dropdown.Option(fmt) for fmt in [*VIDEO_FORMAT_CODECS, *GIF_FORMAT_CODECS]],
             padding=15,
             on_change=self.dd_codec
         )
@@ -174,43 +319,47 @@ class VideoConverter(ft.Column):
             scale=0.8
         )
 
+    def create_preset_dropdown(self) -> ft.Dropdown:
+        return ft.Dropdown(
+            width=150,
+            label='Preset',
+            border_radius=10,
+            padding=15,
+            value='Auto',
+            options=[ft.dropdown.Option(preset) for preset in ['Auto'] + PRESETS]
+        )
+
+    def create_number_textfield(self, label: str) -> ft.TextField:
+        # Left empty, the encoder's own default (or the scheduler's thread estimate) is used
+        return ft.TextField(
+            label=label,
+            width=100,
+            max_lines=1,
+            hint_text='Auto'
+        )
+
     def create_progress_bar(self, label: str) -> ft.ProgressBar:
         return ft.ProgressBar(width=500, height=8, visible=False, tooltip=label)
 
     def dd_codec(self, event):
-        format_codecs = {
-            # Video
-            'mp4': ['libx264', 'libx265', 'mpeg4'],
-            'avi': ['libx264', 'libxvid', 'png', 'rawvideo'],
-            'webm': ['libvpx', 'libvpx-vp9', 'libvorbis'],
-            'mkv': ['libx264', 'libx265', 'vp8', 'vp9', 'mpeg4'],
-            'mov': ['libx264', 'mpeg4', 'prores'],
-            'flv': ['libx264', 'flv1'],
-            'ts': ['libx264', 'h264', 'mpeg2video'],
-            'ogv': ['libtheora', 'libvorbis'],
-            '3gp': ['mpeg4', 'h263'],
-            'gif': ['gif'],
-            # Audio
-            'wav': ['pcm_s16le'],
-            'mp3': ['libmp3lame'],
-            'aac': ['aac', 'libfdk_aac'],
-            'm4a': ['libfdk_aac'],
-            'ogg': ['libvorbis'],
-            'flac': ['flac'],
-            'opus': ['libopus']
-        }
         self.format_selected = self.format_dd.value
-        codecs = format_codecs.get(self.format_selected, ['-'])
+        codecs = {**VIDEO_FORMAT_CODECS, **GIF_FORMAT_CODECS}.get(self.format_selected, ['-'])
         self.codec_dd.options = [ft.dropdown.Option(codec) for codec in codecs]
         self.codec_dd.value = codecs[0]
         if self.format_selected:
             self.convert_button.disabled = False
-        if self.format_selected in ['wav', 'mp3', 'aac', 'm4a', 'ogg', 'flac', 'opus']: # if audio
+        animated = self.format_selected in GIF_FORMAT_CODECS
+        if self.format_selected in AUDIO_FORMATS: # if audio
             self.fps_dd.visible = False
             self.audio_switch.visible = False
         else: 
             self.fps_dd.visible = True
-            self.audio_switch.visible = True
+            self.audio_switch.visible = not animated
+        # GIF and animated WebP have their own size and palette settings instead of the encoder's
+        for field in self.encoder_fields:
+            field.visible = not animated
+        self.width_field.visible = animated
+        self.colors_field.visible = self.format_selected == 'gif'
         self.page.update()
 
     def dd_fps(self, event):
@@ -220,66 +369,105 @@ class VideoConverter(ft.Column):
     def convert(self, event):
         files = self.file_picker.selected_files
         if files:
-            successful = True
-            total_files = len(files)
-            codec_selected = self.codec_dd.value
             fps_selected = self.user_fps.value if self.fps_dd.value == 'Your' else self.fps_dd.value
             fps_selected = None if fps_selected == 'Auto' else int(fps_selected)
-            audio = self.audio_switch.value
+            paths = [file.path for file in files]
+            if self.format_selected in GIF_FORMAT_CODECS:
+                width = int(self.width_field.value) if self.width_field.value.isdigit() else None
+                colors = min(256, max(2, int(self.colors_field.value))) if self.colors_field.value.isdigit() else None
+                settings = (paths, self.format_selected, self.codec_dd.value, fps_selected, width, colors)
+                self.runner.submit(lambda token: self.convert_animations(token, *settings))
+                return
+            encoder_options = {
+                'preset': None if self.preset_dd.value == 'Auto' else self.preset_dd.value,
+                'crf': int(self.crf_field.value) if self.crf_field.value.isdigit() else None,
+                'bitrate': self.bitrate_field.value.strip() or None
+            }
+            threads = int(self.threads_field.value) if self.threads_field.value.isdigit() else None
+            segments = int(self.segments_field.value) if self.segments_field.value.isdigit() else None
+            settings = (paths, self.format_selected, self.codec_dd.value, fps_selected, self.audio_switch.value, encoder_options, threads, segments)
+            self.runner.submit(lambda token: self.convert_files(token, *settings))
+
+    def convert_files(self, token, paths, format_selected, codec_selected, fps_selected, audio, encoder_options, threads, segments, batch=None):
+        self.run_batch(token, len(paths), lambda on_start, on_done: convert_videos(
+            paths, format_selected, codec_selected, fps_selected, audio, encoder_options, threads,
+            self.destination.output_dir, on_start=on_start, on_done=on_done, token=token, cache=self.cache, staging=self.staging,
+            journal=self.journal, batch=batch, template=self.destination.template, segments=segments,
+            metrics=self.metrics
+        ))
+
+    def convert_animations(self, token, paths, format_selected, codec_selected, fps_selected, width, colors, batch=None):
+        self.run_batch(token, len(paths), lambda on_start, on_done: convert_gifs(
+            paths, format_selected, codec_selected, fps_selected, width, colors, self.destination.output_dir,
+            on_start=on_start, on_done=on_done, token=token, cache=self.cache, staging=self.staging,
+            journal=self.journal, batch=batch, template=self.destination.template, metrics=self.metrics
+        ))
+
+    def run_batch(self, token, total_files, convert):
+        # convert(on_start, on_done) runs the engine with the panel's per-file progress rows
+        self.successful = True
+        self.completed = 0
+        rows = {}
+
+        self.progress_bar_overall_label.visible = True
+        self.progress_bar_overall.visible = True
+        self.jobs_column.visible = True
+        self.progress_bar_overall.value = 0
+        self.job_controls.set_running(True)
+        self.page.update()
 
-            self.progress_bar_overall_label.visible = True
-            self.progress_bar_overall.visible = True
-            self.progress_bar_file_label.visible = True
-            self.progress_bar_file.visible = True
-            self.progress_bar_overall.value = 0
+        def on_start(job):
+            filename = os.path.basename(job.output_path)+' '
+            progress_label = ft.Text(value=f"Converting {filename}")
+            progress_bar = self.create_progress_bar(label=filename)
+            progress_bar.visible = True
+            rows[job] = ft.Column([progress_label, progress_bar], spacing=2)
+            self.jobs_column.controls.append(rows[job])
+            self.page.update()
+            return CustomBarLogger(self.page, progress_bar, progress_label, filename, token)
+
+        def on_done(job, error):
+            if job in rows:
+                self.jobs_column.controls.remove(rows.pop(job))
+            if error and not isinstance(error, ConversionCancelled):
+                print(f"Error converting file {job.input_path}: {error}")
+                snack(f"Error converting file {job.input_path}: {error}", self.page)
+                self.successful = False
+            self.completed += 1
+            self.progress_bar_overall_label.value = f'Overall Progress {self.completed}/{total_files}'
+            self.progress_bar_overall.value = self.completed / total_files
             self.page.update()
 
-            for index, file in enumerate(files):
-                try:
-                    clip = moviepy.VideoFileClip(file.path)
-                    base_path = '.'.join(file.path.split('.')[:-1])
-                    output_path = generate_unique_filename(base_path, self.format_selected)
-                    self.filename = output_path.split('\\')[-1]+' '
-
-                    self.progress_bar_file_label.value = f"Converting {self.filename}"
-                    self.page.update()
-
-                    logger = CustomBarLogger(self.page, self.progress_bar_file, self.progress_bar_file_label, self.filename)
-                    if self.format_selected not in ['wav', 'mp3', 'aac', 'm4a', 'ogg', 'flac', 'opus']: # if not audio
-                        clip.write_videofile(
-                            output_path,
-                            codec=codec_selected,
-                            fps=fps_selected,
-                            audio=audio,
-                            logger=logger
-                        )
-                    else:
-                        clip.audio.write_audiofile(output_path, codec=codec_selected, logger=logger)
-                except Exception as e:
-                    print(f"Error converting file {file.path}: {e}")
-                    snack(f"Error converting file {file.path}: {e}", self.page)
-                    successful = False
-                finally:
-                    self.progress_bar_overall_label.value = f'Overall Progress {index + 1}/{total_files}'
-                    self.progress_bar_overall.value = (index + 1) / total_files
-                    self.page.update()
-
-            
+        try:
+            convert(on_start, on_done)
+            if self.successful: snack('All files converted successfully', self.page)
+        finally:
             self.progress_bar_overall_label.value = 'Overall Progress'
-            for bar in [self.progress_bar_overall_label,  self.progress_bar_overall,  
-                        self.progress_bar_file_label, self.progress_bar_file]:
+            for bar in [self.progress_bar_overall_label,  self.progress_bar_overall, self.jobs_column]:
                 bar.visible = False
-            if successful: snack('All files converted successfully', self.page)
+            self.job_controls.set_running(False)
             self.page.update()
             
             
 class AudioConverter(ft.Column):
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, cache: ConversionCache, staging: Staging, journal: JobJournal, destination: Destination,
+                 metrics: MetricsLog):
         super().__init__()
         self.page = page 
+        self.cache = cache
+        self.staging = staging
+        self.journal = journal
+        self.destination = destination
+        self.metrics = metrics
+        self.resume_offered = False
         self.create_elements()
         self.setup_layout()
     
+    def did_mount(self):
+        threading.Thread(target=video_warm_up, daemon=True).start()  # the audio engine runs on video_engine's ffmpeg
+        offer_resume(self, {'audio': lambda token, paths, settings, batch: self.convert_files(
+            token, paths, settings['output_format'], settings['codec'], batch)})
+
     def create_elements(self):
         self.convert_label = ft.Text('Convert to: ', style=ft.TextStyle(size=22))
         self.format_dd = self.create_format_dropdown()
@@ -290,6 +478,8 @@ class AudioConverter(ft.Column):
         self.progress_bar_file = self.create_progress_bar(label="File Progress")
         self.file_picker = FilePicker(self.page, ft.FilePickerFileType.AUDIO)
         self.convert_button = ft.ElevatedButton('Convert', icon=ft.icons.TASK_ALT, on_click=self.convert, disabled=True)
+        self.runner = JobRunner()
+        self.job_controls = JobControls(self.page, self.runner)
 
     def setup_layout(self):
         format_row = ft.Row([
@@ -299,7 +489,8 @@ class AudioConverter(ft.Column):
         ])
         
         convert_row = ft.Row([
-            self.convert_button
+            self.convert_button,
+            self.job_controls
         ])
 
         title_label = LabelTitle('Audio files converter')
@@ -311,7 +502,7 @@ class AudioConverter(ft.Column):
             width=150,
             label='Format',
             border_radius=10,
-            options=[ft.dropdown.Option(fmt) for fmt in ['wav', 'mp3', 'aac', 'm4a', 'ogg', 'flac', 'opus']],
+            options=[ft.dropdown.Option(fmt) for fmt in AUDIO_FORMAT_CODECS],
             padding=15,
             on_change=self.dd_codec
         )
@@ -330,18 +521,8 @@ class AudioConverter(ft.Column):
         return ft.ProgressBar(width=500, height=8, visible=False, tooltip=label)
 
     def dd_codec(self, event):
-        format_codecs = {
-            # Audio
-            'wav': ['pcm_s16le'],
-            'mp3': ['libmp3lame'],
-            'aac': ['aac', 'libfdk_aac'],
-            'm4a': ['aac', 'alac'],
-            'ogg': ['libvorbis'],
-            'flac': ['flac'],
-            'opus': ['opus']
-        }
         self.format_selected = self.format_dd.value
-        codecs = format_codecs.get(self.format_selected, ['-'])
+        codecs = AUDIO_FORMAT_CODECS.get(self.format_selected, ['-'])
         self.codec_dd.options = [ft.dropdown.Option(codec) for codec in codecs]
         self.codec_dd.value = codecs[0]
         if self.format_selected:
@@ -351,72 +532,102 @@ class AudioConverter(ft.Column):
     def convert(self, event):
         files = self.file_picker.selected_files
         if files:
-            successful = True
-            total_files = len(files)
-            codec_selected = self.codec_dd.value
-
-            self.progress_bar_overall_label.visible = True
-            self.progress_bar_overall.visible = True
-            self.progress_bar_file_label.visible = True
-            self.progress_bar_file.visible = True
-            self.progress_bar_overall.value = 0
-            self.page.update()
+            settings = ([file.path for file in files], self.format_selected, self.codec_dd.value)
+            self.runner.submit(lambda token: self.convert_files(token, *settings))
+
+    def convert_files(self, token, paths, format_selected, codec_selected, batch=None):
+        self.successful = True
+        self.completed = 0
+        total_files = len(paths)
+
+        self.progress_bar_overall_label.visible = True
+        self.progress_bar_overall.visible = True
+        self.progress_bar_file_label.visible = True
+        self.progress_bar_file.visible = True
+        self.progress_bar_overall.value = 0
+        self.job_controls.set_running(True)
+        self.page.update()
 
-            for index, file in enumerate(files):
-                try:
-                    clip = moviepy.AudioFileClip(file.path)
-                    base_path = '.'.join(file.path.split('.')[:-1])
-                    output_path = generate_unique_filename(base_path, self.format_selected)
-                    self.filename = output_path.split('\\')[-1]+' '
-
-                    self.progress_bar_file_label.value = f"Converting {self.filename}"
-                    self.page.update()
-
-                    logger = CustomBarLogger(self.page, self.progress_bar_file, self.progress_bar_file_label, self.filename)
-                    clip.write_audiofile(output_path, codec=codec_selected, logger=logger, fps=48000 if codec_selected == 'opus' else None)
-                except Exception as e:
-                    print(f"Error converting file {file.path}: {e}")
-                    snack(f"Error converting file {file.path}: {e}", self.page)
-                    successful = False
-                finally:
-                    self.progress_bar_overall_label.value = f'Overall Progress {index + 1}/{total_files}'
-                    self.progress_bar_overall.value = (index + 1) / total_files
-                    self.page.update()
+        def on_start(job):
+            self.filename = os.path.basename(job.output_path)+' '
+            self.progress_bar_file_label.value = f"Converting {self.filename}"
+            self.page.update()
+            return CustomBarLogger(self.page, self.progress_bar_file, self.progress_bar_file_label, self.filename, token)
+
+        def on_done(job, error):
+            if error and not isinstance(error, ConversionCancelled):
+                print(f"Error converting file {job.input_path}: {error}")
+                snack(f"Error converting file {job.input_path}: {error}", self.page)
+                self.successful = False
+            self.completed += 1
+            self.progress_bar_overall_label.value = f'Overall Progress {self.completed}/{total_files}'
+            self.progress_bar_overall.value = self.completed / total_files
+            self.page.update()
 
-            
+        try:
+            # One file at a time, since the panel has a single file progress bar
+            convert_audios(paths, format_selected, codec_selected, self.destination.output_dir, max_jobs=1, on_start=on_start, on_done=on_done,
+                           token=token, cache=self.cache, staging=self.staging, journal=self.journal, batch=batch, template=self.destination.template,
+                           metrics=self.metrics)
+            if self.successful: snack('All files converted successfully', self.page)
+        finally:
             self.progress_bar_overall_label.value = 'Overall Progress'
             for bar in [self.progress_bar_overall_label,  self.progress_bar_overall,  
                         self.progress_bar_file_label, self.progress_bar_file]:
                 bar.visible = False
-            if successful: snack('All files converted successfully', self.page)
+            self.job_controls.set_running(False)
             self.page.update()
         
 
 class ImageConverter(ft.Column):
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, cache: ConversionCache, staging: Staging, journal: JobJournal, destination: Destination,
+                 metrics: MetricsLog):
         super().__init__()
         self.page = page
+        self.cache = cache
+        self.staging = staging
+        self.journal = journal
+        self.destination = destination
+        self.metrics = metrics
+        self.resume_offered = False
         self.create_elements()
         self.setup_layout()
         
+    def did_mount(self):
+        threading.Thread(target=image_warm_up, daemon=True).start()
+        offer_resume(self, {'image': lambda token, paths, settings, batch: self.convert_files(
+            token, paths, settings['image_format'], settings['quality'], settings['effort'], settings['workers'],
+            settings['memory_budget'], settings['sizes'], batch)})
+
     def create_elements(self):
         self.convert_label = ft.Text('Convert to: ', style=ft.TextStyle(size=22))
         self.format_dd = self.create_format_dropdown()
         self.quality_dd = self.create_quality_dropdown()
+        self.effort_dd = self.create_effort_dropdown()
+        self.workers_field = self.create_workers_textfield()
+        self.memory_field = self.create_memory_textfield()
+        self.sizes_field = self.create_sizes_textfield()
         self.file_picker = FilePicker(self.page, ft.FilePickerFileType.IMAGE)
         self.progress_bar_overall_label = ft.Text(value="Overall Progress", visible=False)
         self.progress_bar_overall = self.create_progress_bar(label="Overall Progress")
         self.convert_button = ft.ElevatedButton('Convert', icon=ft.icons.TASK_ALT, on_click=self.convert, disabled=True)
+        self.runner = JobRunner()
+        self.job_controls = JobControls(self.page, self.runner)
         
     def setup_layout(self):
         format_row = ft.Row([
             self.convert_label,
             self.format_dd,
-            self.quality_dd
+            self.quality_dd,
+            self.effort_dd,
+            self.workers_field,
+            self.memory_field,
+            self.sizes_field
         ])
         
         convert_row = ft.Row([
-            self.convert_button
+            self.convert_button,
+            self.job_controls
         ])
         
         title_label = LabelTitle('Image files converter')
@@ -427,7 +638,7 @@ class ImageConverter(ft.Column):
             width=150,
             label='Format',
             border_radius=10,
-            options=[ft.dropdown.Option(fmt) for fmt in ["JPEG", "PNG", "GIF", "BMP", "TIFF", "WebP"]],
+            options=[ft.dropdown.Option(fmt) for fmt in IMAGE_FORMATS],
             padding=15,
             on_change=self.convert_enable
         )
@@ -437,23 +648,52 @@ class ImageConverter(ft.Column):
             width=150,
             label='Quality',
             border_radius=10,
-            options=[ft.dropdown.Option(fmt) for fmt in ['High', 'Medium', 'Low']],
+            options=[ft.dropdown.Option(fmt) for fmt in QUALITY_PRESETS],
             padding=15,
             value='High'
         )
+
+    def create_effort_dropdown(self) -> ft.Dropdown:
+        return ft.Dropdown(
+            width=150,
+            label='Effort',
+            tooltip='Fast encodes quickest, Small spends more time for smaller files',
+            border_radius=10,
+            options=[ft.dropdown.Option(effort) for effort in EFFORT_PRESETS],
+            padding=15,
+            value=DEFAULT_EFFORT
+        )
+
+    def create_workers_textfield(self) -> ft.TextField:
+        return ft.TextField(
+            label='Workers',
+            width=100,
+            max_lines=1,
+            value=str(default_workers())
+        )
+
+    def create_memory_textfield(self) -> ft.TextField:
+        return ft.TextField(
+            label='Memory/job (MB)',
+            width=140,
+            max_lines=1,
+            value=str(DEFAULT_MEMORY_BUDGET // 1024**2)
+        )
+
+    def create_sizes_textfield(self) -> ft.TextField:
+        return ft.TextField(
+            label='Sizes',
+            hint_text='2048, 1024 or 800x600',
+            width=180,
+            max_lines=1
+        )
     
     def create_progress_bar(self, label: str) -> ft.ProgressBar:
         return ft.ProgressBar(width=500, height=8, visible=False, tooltip=label)
 
     def convert_enable(self, event):
-        quality_dict = {
-            'High': 90,
-            'Medium': 55,
-            'Low': 25
-        }
-        
         self.format_selected = self.format_dd.value
-        self.quality_selected = quality_dict[str(self.quality_dd.value)]
+        self.quality_selected = QUALITY_PRESETS[str(self.quality_dd.value)]
         if self.format_selected:
             self.convert_button.disabled = False
         self.page.update()
@@ -461,43 +701,98 @@ class ImageConverter(ft.Column):
     def convert(self, event):
         files = self.file_picker.selected_files
         if files:
-            successful = True
-            total_files = len(files)
-            for index, file in enumerate(files):
-                base_path = '.'.join(file.path.split('.')[:-1])
-                output_path = generate_unique_filename(base_path, self.format_selected)
-                self.filename = output_path.split('\\')[-1]
-                try:
-                    image = Image.open(file.path)
-                    image.save(output_path, format=self.format_selected, quality=self.quality_selected)
-                except Exception as e:
-                    print(f"Error converting file {file.path}: {e}")
-                    snack(f"Error converting file {file.path}: {e}", self.page)
-                    successful = False
-                finally:
-                    self.progress_bar_overall_label.value = f'Overall Progress {index + 1}/{total_files}'
-                    self.progress_bar_overall.value = (index + 1) / total_files
-                    self.page.update()
+            workers = int(self.workers_field.value) if self.workers_field.value.isdigit() else default_workers()
+            memory_budget = int(self.memory_field.value) * 1024**2 if self.memory_field.value.isdigit() else None
+            try:
+                sizes = parse_sizes(self.sizes_field.value or '')
+            except ValueError as e:
+                snack(str(e), self.page)
+                return
+            settings = ([file.path for file in files], self.format_selected, self.quality_selected, self.effort_dd.value, workers, memory_budget, sizes)
+            self.runner.submit(lambda token: self.convert_files(token, *settings))
+
+    def convert_files(self, token, paths, format_selected, quality_selected, effort, workers, memory_budget, sizes, batch=None):
+        self.successful = True
+        self.completed = 0
+        total_files = len(paths) * len(sizes or [None])
+        partial = {}  # input path -> fraction of its frames encoded, None once finished
+        last_update = [0]
+
+        self.progress_bar_overall_label.visible = True
+        self.progress_bar_overall.visible = True
+        self.progress_bar_overall.value = 0
+        self.job_controls.set_running(True)
+        self.page.update()
 
-            
+        def on_done(input_path, output_path, error):
+            if error:
+                print(f"Error converting file {input_path}: {error}")
+                snack(f"Error converting file {input_path}: {error}", self.page)
+                self.successful = False
+            self.completed += 1
+            partial[input_path] = None
+            self.progress_bar_overall_label.value = f'Overall Progress {self.completed}/{total_files}'
+            self.progress_bar_overall.value = self.completed / total_files
+            self.page.update()
+
+        def on_note(input_path, message):
+            print(f"{input_path}: {message}")
+            snack(f"{os.path.basename(input_path)}: {message}", self.page)
+
+        def on_progress(input_path, frame, frames):
+            if input_path in partial and partial[input_path] is None:
+                return  # a late report for a file that already finished
+            partial[input_path] = frame / frames / len(sizes or [None])
+            now = time.monotonic()
+            if now - last_update[0] < 1 / PROGRESS_MAX_RATE:
+                return
+            last_update[0] = now
+            running = sum(fraction for fraction in partial.values() if fraction is not None)
+            self.progress_bar_overall.value = (self.completed + running) / total_files
+            self.page.update(self.progress_bar_overall)
+
+        try:
+            convert_images(paths, format_selected, quality_selected, workers, self.destination.output_dir,
+                           on_done=on_done, token=token, cache=self.cache, memory_budget=memory_budget, on_progress=on_progress, sizes=sizes, effort=effort,
+                           staging=self.staging, journal=self.journal, batch=batch, template=self.destination.template, metrics=self.metrics,
+                           on_note=on_note)
+            if self.successful: snack('All files converted successfully', self.page)
+        finally:
             self.progress_bar_overall_label.value = 'Overall Progress'
             self.progress_bar_overall_label.visible = False
             self.progress_bar_overall.visible = False
-
-            if successful: snack('All files converted successfully', self.page)
+            self.job_controls.set_running(False)
             self.page.update()
         
 
 class Settings(ft.Column):
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, cache: ConversionCache, staging: Staging, destination: Destination, metrics: MetricsLog):
         super().__init__()
         self.page = page
+        self.cache = cache
+        self.staging = staging
+        self.destination = destination
+        self.metrics = metrics
         self.create_elements()
         self.setup_layout()
     
     def create_elements(self):
         self.dd_check_theme = ft.Dropdown(label='Theme mode', width=150, options=[ft.dropdown.Option('System'), ft.dropdown.Option('Dark'), ft.dropdown.Option('Light')], on_change=self.change_theme)
         self.btn_dev = ft.IconButton(icon=ft.icons.DEVELOPER_MODE, tooltip='Contact with developer', url='https://t.me/dexering')
+        self.cache_switch = ft.Switch(label='  Conversion cache', value=self.cache.enabled, on_change=self.change_cache)
+        self.cache_size_field = ft.TextField(label='Cache size (GB)', width=150, max_lines=1, value=f'{self.cache.max_bytes / 1024**3:g}', on_change=self.change_cache)
+        self.btn_clear_cache = ft.ElevatedButton('Clear cache', icon=ft.icons.DELETE_SWEEP, on_click=self.clear_cache)
+        self.read_ahead_switch = ft.Switch(label='  Read ahead (network drives)', value=bool(self.staging.depth), on_change=self.change_staging)
+        self.read_ahead_field = ft.TextField(label='Files ahead', width=100, max_lines=1, value=str(self.staging.depth or DEFAULT_DEPTH), on_change=self.change_staging)
+        self.scratch_field = ft.TextField(label='Scratch folder', hint_text='system temp', width=250, max_lines=1, value=self.staging.scratch_dir or '', on_change=self.change_staging)
+        self.output_dir_field = ft.TextField(label='Output folder', hint_text='next to each file', width=250, max_lines=1, value=self.destination.output_dir or '', on_change=self.change_destination)
+        self.template_field = ft.TextField(label='File name', hint_text=DEFAULT_TEMPLATE, width=250, max_lines=1, value=self.destination.template, on_change=self.change_destination,
+                                           tooltip='{stem} {suffix} {format} {parent} {index}, folders allowed: {parent}/{stem}')
+        # Applied when the field loses focus, so no port is opened for a half-typed number
+        self.metrics_file_field = ft.TextField(label='Metrics file', hint_text='off', width=250, max_lines=1, value=self.metrics.path or '', on_blur=self.change_metrics,
+                                               tooltip='Timings, CPU time, sizes and peak memory of every file; .csv for CSV, otherwise JSON lines')
+        self.metrics_port_field = ft.TextField(label='Metrics port', hint_text='off', width=120, max_lines=1, on_blur=self.change_metrics,
+                                               tooltip='Serve totals for Prometheus at http://localhost:<port>/metrics')
         
     def setup_layout(self):
         theme_row = ft.Row([
@@ -505,12 +800,75 @@ class Settings(ft.Column):
             self.dd_check_theme,
             ft.Container(content=self.btn_dev, margin=ft.Margin(400, 0, 0, 0)),
         ])
+
+        cache_row = ft.Row([
+            self.cache_switch,
+            self.cache_size_field,
+            self.btn_clear_cache
+        ])
+        
+        staging_row = ft.Row([
+            self.read_ahead_switch,
+            self.read_ahead_field,
+            self.scratch_field
+        ])
+        
+        destination_row = ft.Row([
+            self.output_dir_field,
+            self.template_field
+        ])
+        
+        metrics_row = ft.Row([
+            self.metrics_file_field,
+            self.metrics_port_field
+        ])
         
-        self.controls = [theme_row]
+        self.controls = [theme_row, cache_row, staging_row, destination_row, metrics_row]
         
     def change_theme(self, event):
         self.page.theme_mode = self.dd_check_theme.value.lower()
         self.page.update()
+
+    def change_cache(self, event):
+        self.cache.enabled = self.cache_switch.value
+        try:
+            self.cache.max_bytes = int(float(self.cache_size_field.value) * 1024**3)
+        except ValueError:
+            return
+        self.cache.evict()
+
+    def change_staging(self, event):
+        depth = int(self.read_ahead_field.value) if self.read_ahead_field.value.isdigit() else DEFAULT_DEPTH
+        self.staging.depth = depth if self.read_ahead_switch.value else 0
+        self.staging.scratch_dir = self.scratch_field.value or None
+
+    def change_destination(self, event):
+        self.destination.output_dir = self.output_dir_field.value.strip() or None
+        template = self.template_field.value.strip() or DEFAULT_TEMPLATE
+        try:
+            check_template(template)
+        except ValueError as e:
+            self.template_field.error_text = str(e)
+        else:
+            self.template_field.error_text = None
+            self.destination.template = template
+        self.page.update()
+
+    def change_metrics(self, event):
+        self.metrics.set_path(self.metrics_file_field.value.strip())
+        port = self.metrics_port_field.value.strip()
+        try:
+            self.metrics.set_port(int(port) if port.isdigit() else None)
+        except OSError as e:
+            self.metrics_port_field.error_text = str(e)
+        else:
+            self.metrics_port_field.error_text = None
+        self.page.update()
+
+    def clear_cache(self, event):
+        self.cache.clear()
+        snack('Cache cleared', self.page)
+        self.page.update()
         
         
 def main(page: ft.Page):
@@ -525,13 +883,19 @@ def main(page: ft.Page):
     page.padding = 10
 
     
-    video_panel = VideoConverter(page)
+    cache = ConversionCache()
+    staging = Staging()
+    journal = JobJournal()
+    destination = Destination()
+    metrics = MetricsLog()
+
+    video_panel = VideoConverter(page, cache, staging, journal, destination, metrics)
     
-    audio_panel = AudioConverter(page)
+    audio_panel = AudioConverter(page, cache, staging, journal, destination, metrics)
     
-    image_panel = ImageConverter(page)
+    image_panel = ImageConverter(page, cache, staging, journal, destination, metrics)
     
-    settings_panel = Settings(page)
+    settings_panel = Settings(page, cache, staging, destination, metrics)
     
     def navigate(event):
         page.clean()
@@ -572,4 +936,7 @@ def main(page: ft.Page):
         expand=True
     ))
 
-ft.app(target=main)
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    ft.app(target=main)
+
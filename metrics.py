@@ -0,0 +1,267 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import json
+import csv
+import os
+
+
+# Stages a job's time is split into. ffmpeg decodes and encodes in one process, so for video and
+# audio that time is all under encode; Pillow jobs fill in decode (and resize) separately.
+# hash is reading the source for its conversion cache key.
+STAGES = ['probe', 'hash', 'decode', 'resize', 'encode', 'write']
+
+# The Prometheus endpoint listens on this machine only unless another host is asked for
+DEFAULT_HOST = '127.0.0.1'
+
+FIELDS = ['kind', 'input_path', 'outputs', 'started', 'seconds', *[f'{stage}_seconds' for stage in STAGES],
+          'cpu_seconds', 'bytes_in', 'bytes_out', 'peak_rss', 'ffmpeg_status', 'cached', 'error']
+
+
+def process_usage(process):
+    # -> (cpu seconds, peak RSS in bytes) of a finished subprocess on Windows, read from its still-open handle
+    import ctypes
+    from ctypes import wintypes
+
+    class MemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t), ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    handle = wintypes.HANDLE(int(process._handle))
+    counters = MemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
+    times = [wintypes.FILETIME() for _ in range(4)]
+    ctypes.windll.kernel32.GetProcessTimes(handle, *[ctypes.byref(value) for value in times])
+    kernel, user = [(value.dwHighDateTime << 32 | value.dwLowDateTime) / 1e7 for value in times[2:]]
+    return kernel + user, counters.PeakWorkingSetSize
+
+
+def reset_peak_rss():
+    # Linux only: lets peak_rss report the high-water mark of the next job rather than of the whole worker
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    # -> peak resident memory of this process in bytes, or None where it can't be read
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if os.uname().sysname == 'Darwin' else 1024)
+
+
+class JobProfile():
+    # Where one conversion spent its time, filled in by the engines as it runs; picklable, so pool workers
+    # send theirs back with the result
+    def __init__(self, kind=None, input_path=None):
+        self.kind = kind
+        self.input_path = input_path
+        self.started = time.time()
+        self.stages = {}
+        self.cpu_seconds = None  # ffmpeg processes
+        self.peak_rss = None
+        self.ffmpeg_status = None
+        self.cached = False
+        self.notes = []  # what the caller should hear about that isn't an error
+
+    def start(self):
+        self.started = time.time()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def stage(self, stage):
+        return Stage(self, stage)
+
+    def add_process(self, returncode, cpu_seconds=None, rss=None):
+        # An ffmpeg run; the first failing status is kept, so a chunked encode reports the piece that broke
+        if self.ffmpeg_status in [None, 0]:
+            self.ffmpeg_status = returncode
+        if cpu_seconds is not None:
+            self.cpu_seconds = (self.cpu_seconds or 0) + cpu_seconds
+        self.note_rss(rss)
+
+    def note_rss(self, rss):
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def merge(self, other):
+        # Adds what a pool worker measured
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+        self.note_rss(other.peak_rss)
+        self.cached = self.cached or other.cached
+        self.notes += other.notes
+
+    def record(self, output_paths, error=None):
+        def size(path):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return 0
+
+        return {
+            'kind': self.kind,
+            'input_path': self.input_path,
+            'outputs': list(output_paths),
+            'started': round(self.started, 3),
+            'seconds': round(time.time() - self.started, 3),
+            **{f'{stage}_seconds': round(self.stages[stage], 3) if stage in self.stages else None for stage in STAGES},
+            'cpu_seconds': round(self.cpu_seconds, 3) if self.cpu_seconds is not None else None,
+            'bytes_in': size(self.input_path),
+            'bytes_out': 0 if error else sum(size(path) for path in output_paths),
+            'peak_rss': self.peak_rss,
+            'ffmpeg_status': self.ffmpeg_status,
+            'cached': self.cached,
+            'error': str(error) if error else None
+        }
+
+
+class Stage():
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, time.perf_counter() - self.started)
+
+
+class MetricsLog():
+    # Sink for finished jobs: each record is appended to path (.csv as CSV, anything else as JSONL)
+    # and summed into counters served in Prometheus text format on host:port, for capacity planning.
+    # Shared by the panels and the CLI like the cache; either part may be off.
+    def __init__(self, path=None, port=None, host=DEFAULT_HOST):
+        self.lock = threading.Lock()
+        self.path = None
+        self.host = host  # '0.0.0.0' for every interface
+        self.server = None
+        self.totals = {}  # (metric, labels) -> value
+        self.set_path(path)
+        self.set_port(port)
+
+    def set_path(self, path):
+        with self.lock:
+            self.path = path or None
+
+    def set_port(self, port):
+        if self.server and self.server.server_address[1] == port:
+            return
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if port:
+            self.server = ThreadingHTTPServer((self.host, port), self.handler())
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.server)
+
+    def record(self, record):
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.path:
+                try:
+                    self.append(record)
+                except OSError as e:
+                    print(f"Error writing metrics to {self.path}: {e}")
+            self.count(record)
+
+    def append(self, record):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.path.lower().endswith('.csv'):
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, FIELDS)
+                if new:
+                    writer.writeheader()
+                writer.writerow({**record, 'outputs': ';'.join(record['outputs'])})
+        else:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(record) + '\n')
+
+    def count(self, record):
+        kind = record['kind']
+        status = 'failed' if record['error'] else 'cached' if record['cached'] else 'converted'
+        self.add('fileconverter_jobs_total', {'kind': kind, 'status': status}, 1)
+        self.add('fileconverter_job_seconds_total', {'kind': kind}, record['seconds'])
+        for stage in STAGES:
+            if record[f'{stage}_seconds'] is not None:
+                self.add('fileconverter_stage_seconds_total', {'kind': kind, 'stage': stage}, record[f'{stage}_seconds'])
+        if record['cpu_seconds'] is not None:
+            self.add('fileconverter_ffmpeg_cpu_seconds_total', {'kind': kind}, record['cpu_seconds'])
+        self.add('fileconverter_bytes_in_total', {'kind': kind}, record['bytes_in'])
+        self.add('fileconverter_bytes_out_total', {'kind': kind}, record['bytes_out'])
+        if record['peak_rss']:
+            key = ('fileconverter_job_peak_rss_bytes', (('kind', kind),))
+            self.totals[key] = max(self.totals.get(key, 0), record['peak_rss'])
+
+    def add(self, metric, labels, value):
+        key = (metric, tuple(sorted(labels.items())))
+        self.totals[key] = self.totals.get(key, 0) + value
+
+    def prometheus_text(self):
+        kinds = {
+            'fileconverter_jobs_total': ('counter', 'Finished conversion jobs'),
+            'fileconverter_job_seconds_total': ('counter', 'Wall time spent in conversion jobs'),
+            'fileconverter_stage_seconds_total': ('counter', 'Wall time per job stage'),
+            'fileconverter_ffmpeg_cpu_seconds_total': ('counter', 'CPU time used by ffmpeg processes'),
+            'fileconverter_bytes_in_total': ('counter', 'Bytes read from inputs'),
+            'fileconverter_bytes_out_total': ('counter', 'Bytes written to outputs'),
+            'fileconverter_job_peak_rss_bytes': ('gauge', 'Largest peak resident memory of a single job')
+        }
+        with self.lock:
+            totals = sorted(self.totals.items())
+        lines = []
+        for metric, (metric_type, help_text) in kinds.items():
+            samples = [(labels, value) for (name, labels), value in totals if name == metric]
+            if not samples:
+                continue
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {metric_type}']
+            for labels, value in samples:
+                label_text = ','.join(f'{name}="{value}"' for name, value in labels)
+                lines.append(f'{metric}{{{label_text}}} {value:.15g}' if label_text else f'{metric} {value:.15g}')
+        return '\n'.join(lines) + '\n'
+
+    def handler(self):
+        log = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+                body = log.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # scrapes every few seconds would flood the console
+
+        return Handler
+
+    def close(self):
+        self.set_port(None)
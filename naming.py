@@ -0,0 +1,95 @@
+import os
+
+
+# Output name before the extension. Fields: {stem} input name without extension, {suffix} e.g. _1024 for
+# one of several sizes, {format} target extension, {parent} the input's folder name, {index} 1-based position in the batch.
+# A template may contain folders ('{parent}/{stem}'), created under the output folder as needed.
+DEFAULT_TEMPLATE = '{stem}{suffix}'
+
+
+class Destination():
+    # Output folder and file name template shared by the panels and the Settings page;
+    # no output_dir writes next to each input
+    def __init__(self, output_dir=None, template=DEFAULT_TEMPLATE):
+        self.output_dir = output_dir
+        self.template = template
+
+
+class NameReserver():
+    # One per batch: each output folder is listed once and names are claimed by creating an empty
+    # placeholder with O_EXCL, so a folder full of "name (n).ext" costs no stat per candidate
+    # and two batches writing to the same folder can't both pick a name.
+    # The placeholder is replaced when the output is renamed into place.
+    def __init__(self):
+        self.listings = {}  # folder -> normcased names
+        self.counters = {}  # base path -> next counter to try
+
+    def taken(self, path):
+        directory, name = os.path.split(path)
+        if directory not in self.listings:
+            try:
+                self.listings[directory] = {os.path.normcase(entry) for entry in os.listdir(directory or '.')}
+            except OSError:
+                self.listings[directory] = set()
+        return os.path.normcase(name) in self.listings[directory]
+
+    def claim(self, path):
+        self.listings[os.path.dirname(path)].add(os.path.normcase(os.path.basename(path)))
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False  # created since the folder was listed
+        except OSError:
+            pass  # unwritable folder: the conversion itself reports that
+        return True
+
+    def reserve(self, base_path, extension):
+        directory = os.path.dirname(base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        counter = self.counters.get(base_path, 0)
+        while True:
+            path = f"{base_path}.{extension}" if counter == 0 else f"{base_path} ({counter}).{extension}"
+            counter += 1
+            if not self.taken(path) and self.claim(path):
+                self.counters[base_path] = counter
+                return path
+
+
+def base_name(input_path, extension, template, suffix, index):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    parent = os.path.basename(os.path.dirname(os.path.abspath(input_path)))
+    if '{suffix}' not in template:
+        template += '{suffix}'  # several sizes must still get names of their own
+    return template.format(stem=stem, suffix=suffix, format=extension, parent=parent, index=index)
+
+
+def check_template(template):
+    try:
+        base_name('input.ext', 'ext', template or DEFAULT_TEMPLATE, '', 1)
+    except (KeyError, IndexError, ValueError):
+        raise ValueError(f"Invalid name template: {template} (fields: {{stem}} {{suffix}} {{format}} {{parent}} {{index}})")
+
+
+def output_paths(input_paths, extension, output_dir=None, suffix='', template=None, names=None):
+    # -> [(input_path, output_path)], next to each input unless output_dir is given.
+    # Each name is reserved on disk (see NameReserver); pass the same names to every call for one batch
+    # and release_unused the outputs at the end.
+    names = names or NameReserver()
+    template = template or DEFAULT_TEMPLATE
+    jobs = []
+    for index, input_path in enumerate(input_paths, 1):
+        name = base_name(input_path, extension, template, suffix, index)
+        base_path = os.path.join(output_dir or os.path.dirname(input_path), name)
+        jobs.append((input_path, names.reserve(base_path, extension)))
+    return jobs
+
+
+def release_unused(*paths):
+    # Removes the placeholders of outputs that were never written (failed, cancelled)
+    for path in paths:
+        try:
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+        except OSError:
+            pass
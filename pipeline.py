@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from jobs import partial_path, remove_partial
+import itertools
+import threading
+import tempfile
+import shutil
+import os
+
+
+DEFAULT_DEPTH = 4
+
+
+class Staging():
+    # Read-ahead settings shared by the panels and the CLI; depth 0 converts in place
+    def __init__(self, depth=0, scratch_dir=None):
+        self.depth = depth
+        self.scratch_dir = scratch_dir
+
+    def start(self, input_paths):
+        return Pipeline(input_paths, self.scratch_dir, self.depth) if self.depth else None
+
+
+class Pipeline():
+    # Prefetch -> convert -> write back, for batches on network shares: the next `depth` inputs
+    # are copied to local scratch while earlier ones encode, and finished outputs are moved to
+    # their destination on a background thread, so neither the CPU nor the network sits idle.
+    # input_paths is the order the engine will ask for them in.
+    def __init__(self, input_paths, scratch_dir=None, depth=DEFAULT_DEPTH):
+        if scratch_dir:
+            os.makedirs(scratch_dir, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='FileConverter-', dir=scratch_dir)
+        self.depth = depth
+        self.waiting = list(input_paths)
+        self.fetching = set()
+        self.fetched = {}  # input path -> local copy, or the error copying it
+        self.names = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        threading.Thread(target=self.read_ahead, daemon=True).start()
+
+    def local_path(self, path):
+        return os.path.join(self.directory, f"{next(self.names)}-{os.path.basename(path)}")
+
+    def copy(self, input_path):
+        local_path = self.local_path(input_path)
+        try:
+            shutil.copyfile(input_path, local_path)
+            return local_path
+        except OSError as e:
+            remove_partial(local_path)
+            return e
+
+    def read_ahead(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or not self.waiting or len(self.fetching) + len(self.fetched) < self.depth)
+                if self.closed or not self.waiting:
+                    return
+                input_path = self.waiting.pop(0)
+                self.fetching.add(input_path)
+            self.finish_fetch(input_path, self.copy(input_path))
+
+    def finish_fetch(self, input_path, result):
+        with self.condition:
+            self.fetching.discard(input_path)
+            self.fetched[input_path] = result
+            self.condition.notify_all()
+
+    def ready(self, input_path):
+        with self.condition:
+            return input_path in self.fetched
+
+    def fetch(self, input_path):
+        # -> local copy of input_path; an input the read-ahead hasn't reached yet is copied right here,
+        # so a job started out of order never waits behind the window
+        with self.condition:
+            fetch_here = input_path in self.waiting
+            if fetch_here:
+                self.waiting.remove(input_path)
+                self.fetching.add(input_path)
+            elif input_path not in self.fetching and input_path not in self.fetched:
+                return input_path  # not part of this batch
+        if fetch_here:
+            self.finish_fetch(input_path, self.copy(input_path))
+        with self.condition:
+            self.condition.wait_for(lambda: input_path in self.fetched)
+            result = self.fetched[input_path]
+        if isinstance(result, Exception):
+            self.release(input_path)
+            raise result
+        return result
+
+    def release(self, input_path):
+        with self.condition:
+            local_path = self.fetched.pop(input_path, None)
+            self.condition.notify_all()
+        if isinstance(local_path, str):
+            remove_partial(local_path)
+
+    def scratch_path(self, output_path):
+        return self.local_path(output_path)
+
+    def stage(self, input_path, output_paths, convert):
+        # Runs convert(local input, scratch outputs) on the calling thread -> write-back Future
+        local_input = self.fetch(input_path)
+        scratch_paths = [self.scratch_path(output_path) for output_path in output_paths]
+        try:
+            convert(local_input, scratch_paths)
+        except BaseException:
+            self.discard(input_path, scratch_paths)
+            raise
+        return self.write_back(input_path, list(zip(scratch_paths, output_paths)))
+
+    def write_back(self, input_path, outputs):
+        # outputs: [(scratch path, destination)]; -> Future that completes once all are in place
+        self.release(input_path)
+        return self.writer.submit(self.move, outputs)
+
+    def move(self, outputs):
+        try:
+            for scratch_path, output_path in outputs:
+                # copied under a temporary name first, so the destination never holds a partial file
+                partial = partial_path(output_path)
+                try:
+                    shutil.copyfile(scratch_path, partial)
+                    os.replace(partial, output_path)
+                except BaseException:
+                    remove_partial(partial)
+                    raise
+        finally:
+            remove_partial(*[scratch_path for scratch_path, _ in outputs])
+
+    def discard(self, input_path, scratch_paths):
+        self.release(input_path)
+        remove_partial(*scratch_paths)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.writer.shutdown(wait=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
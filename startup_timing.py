@@ -0,0 +1,49 @@
+# Startup-time measurement mode: times importing the app and building the first page,
+# and checks that the heavy backends are still unloaded when the window first paints.
+#   python startup_timing.py            # report, keep the window open
+#   python startup_timing.py --exit --max-ms 1500   # for CI: close after first paint, fail when slower
+# For a per-module breakdown of the import step use `python -X importtime startup_timing.py --exit`.
+import time
+started = time.perf_counter()
+
+import main as app
+imported = time.perf_counter()
+
+import flet as ft
+import argparse
+import json
+import sys
+
+
+# Modules that should only load when a panel converts or is shown
+LAZY_MODULES = ['moviepy', 'numpy', 'imageio', 'PIL', 'scipy']
+
+
+def measure(page: ft.Page, args, report):
+    app.main(page)
+    painted = time.perf_counter()
+    report.update({
+        'import_ms': round((imported - started) * 1000, 1),
+        'first_paint_ms': round((painted - started) * 1000, 1),
+        'loaded_lazy_modules': [name for name in LAZY_MODULES if name in sys.modules]
+    })
+    print(json.dumps(report))
+    if args.exit:
+        page.window.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import and first-paint time of the converter')
+    parser.add_argument('--exit', action='store_true', help='close the window after the first paint')
+    parser.add_argument('--max-ms', type=float, help='exit with status 1 when first paint takes longer')
+    args = parser.parse_args()
+
+    report = {}
+    ft.app(target=lambda page: measure(page, args, report))
+    if args.max_ms and report.get('first_paint_ms', float('inf')) > args.max_ms:
+        return 1
+    return 1 if report.get('loaded_lazy_modules') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
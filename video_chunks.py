@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from ffmpeg_tools import run_ffmpeg, first_stream, CONTAINER_CODECS, ENCODER_CODECS
+from jobs import CancelToken, ConversionCancelled
+import threading
+import tempfile
+import shutil
+import glob
+import os
+
+
+# Pieces shorter than this spend more on ffmpeg start-up and the extra keyframes than they gain
+MIN_SEGMENT_SECONDS = 60
+
+
+def segment_count(job, segments):
+    # -> how many pieces job is encoded in; 1 encodes it whole
+    if not segments or segments < 2 or not job.info or not first_stream(job.info, 'video'):
+        return 1
+    return max(1, min(segments, int(job.duration // MIN_SEGMENT_SECONDS)))
+
+
+def segment_extension(codec, output_format):
+    # Encoded pieces go into Matroska when it can hold the codec, which concatenates without timestamp trouble
+    return 'mkv' if ENCODER_CODECS.get(codec) in CONTAINER_CODECS['mkv'][0] else output_format
+
+
+def split(input_path, directory, duration, count, token=None, profile=None):
+    # Copies the video stream into count pieces; the segment muxer only cuts on keyframes,
+    # so every piece decodes on its own and none of them overlap
+    times = ','.join(f'{duration * index / count:.3f}' for index in range(1, count))
+    run_ffmpeg(['-i', input_path, '-map', '0:v:0', '-c', 'copy', '-f', 'segment', '-segment_times', times,
+                '-reset_timestamps', '1', os.path.join(directory, 'source%03d.mkv')], token, profile=profile)
+    return sorted(glob.glob(os.path.join(directory, 'source*.mkv')))
+
+
+def encode_chunked(input_path, output_path, duration, count, workers, video_args, audio_args, extension, token=None, on_progress=None,
+                   profile=None):
+    # Split -> encode the pieces in `workers` parallel ffmpeg processes -> concat demuxer.
+    # video_args encode one piece without audio; audio_args (None for no soundtrack) encode the
+    # whole soundtrack once in a process of its own, so there are no seams at the cuts.
+    # on_progress gets ffmpeg -progress dicts whose frame and total_size are the sums over all pieces.
+    # The pieces live next to the output, since the system temp folder may not hold a copy of a long recording.
+    directory = tempfile.mkdtemp(prefix='.FileConverter-', dir=os.path.dirname(output_path) or None)
+    lock = threading.Lock()
+    frames = {}
+    sizes = {}
+
+    def encode(index, source_path):
+        def progress(values):
+            with lock:
+                frames[index] = int(values.get('frame') or 0)
+                sizes[index] = int(values['total_size']) if values.get('total_size', '').isdigit() else 0  # N/A until the muxer starts
+                values = {**values, 'frame': str(sum(frames.values())), 'total_size': str(sum(sizes.values()))}
+                if on_progress:
+                    on_progress(values)
+
+        encoded_path = os.path.join(directory, f'segment{index:03d}.{extension}')
+        run_ffmpeg(['-i', source_path, *video_args, encoded_path], pieces, progress, profile)
+        return encoded_path
+
+    try:
+        sources = split(input_path, directory, duration, count, token, profile)
+        audio_path = os.path.join(directory, 'audio.mka')
+        # Cancelled when a piece fails, so run_ffmpeg kills the ones still encoding
+        pieces = CancelToken(token)
+        with ThreadPoolExecutor(max_workers=workers + (1 if audio_args else 0)) as executor:
+            futures = []
+            if audio_args:
+                futures.append(executor.submit(run_ffmpeg, ['-i', input_path, *audio_args, audio_path], pieces, None, profile))
+            futures += [executor.submit(encode, index, source_path) for index, source_path in enumerate(sources)]
+            try:
+                wait(futures, return_when=FIRST_EXCEPTION)
+                failed = [future.exception() for future in futures if future.done() and future.exception()]
+                if failed:
+                    # the piece that broke, not the siblings stopped because of it
+                    raise next((error for error in failed if not isinstance(error, ConversionCancelled)), failed[0])
+                results = [future.result() for future in futures]
+            except BaseException:
+                pieces.cancel()
+                for future in futures:
+                    future.cancel()  # not started yet
+                raise
+        segments = results[1:] if audio_args else results
+        list_path = os.path.join(directory, 'segments.txt')
+        with open(list_path, 'w', encoding='utf-8') as file:
+            file.writelines(f"file '{os.path.basename(path)}'\n" for path in segments)
+        inputs = ['-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_args:
+            run_ffmpeg([*inputs, '-i', audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', output_path], token, profile=profile)
+        else:
+            run_ffmpeg([*inputs, '-map', '0:v:0', '-c', 'copy', output_path], token, profile=profile)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,410 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ffmpeg_tools import ffmpeg_binary, probe, first_stream, run_ffmpeg, remux_args
+from jobs import ConversionCancelled, partial_path, remove_partial
+from journal import RUNNING, DONE, FAILED
+from naming import output_paths, release_unused
+from video_chunks import segment_count, segment_extension, encode_chunked
+from metrics import JobProfile
+import copy
+import time
+import os
+
+
+AUDIO_FORMATS = ['wav', 'mp3', 'aac', 'm4a', 'ogg', 'flac', 'opus']
+
+FORMAT_CODECS = {
+    # Video
+    'mp4': ['libx264', 'libx265', 'mpeg4'],
+    'avi': ['libx264', 'libxvid', 'png', 'rawvideo'],
+    'webm': ['libvpx', 'libvpx-vp9', 'libvorbis'],
+    'mkv': ['libx264', 'libx265', 'vp8', 'vp9', 'mpeg4'],
+    'mov': ['libx264', 'mpeg4', 'prores'],
+    'flv': ['libx264', 'flv1'],
+    'ts': ['libx264', 'h264', 'mpeg2video'],
+    'ogv': ['libtheora', 'libvorbis'],
+    '3gp': ['mpeg4', 'h263'],
+    # Audio
+    'wav': ['pcm_s16le'],
+    'mp3': ['libmp3lame'],
+    'aac': ['aac', 'libfdk_aac'],
+    'm4a': ['libfdk_aac'],
+    'ogg': ['libvorbis'],
+    'flac': ['flac'],
+    'opus': ['libopus']
+}
+
+PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+
+# libvpx has no named presets; -cpu-used is its speed/quality dial (higher is faster)
+VPX_CPU_USED = dict(zip(PRESETS, [8, 7, 6, 5, 4, 3, 2, 1, 0]))
+
+# Soundtrack encoder per video container; ffmpeg's own defaults pick encoders some builds lack (amr_nb for 3gp)
+VIDEO_AUDIO_CODECS = {'webm': 'libvorbis', 'ogv': 'libvorbis', 'avi': 'libmp3lame', 'flv': 'libmp3lame'}
+
+
+class VideoJob():
+    def __init__(self, input_path, output_path, width=0, height=0, duration=0, info=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.info = info
+        self.threads = 1
+        self.segments = 1  # > 1: encoded in that many pieces side by side (video_chunks)
+        self.encoder_threads = None  # a segmented job's threads per piece, when given; threads is what the pieces share
+        self.profile = JobProfile('video', input_path)
+
+    @property
+    def weight(self):
+        return self.width * self.height * self.duration
+
+
+def probe_video(input_path, output_path):
+    started = time.perf_counter()
+    try:
+        info = probe(input_path)
+    except Exception:
+        job = VideoJob(input_path, output_path)
+    else:
+        video = first_stream(info, 'video') or {}
+        job = VideoJob(input_path, output_path, video.get('width', 0), video.get('height', 0), info['duration'], info)
+    job.profile.add('probe', time.perf_counter() - started)
+    return job
+
+
+def plan_threads(job, cpu_count, audio_only=False):
+    if audio_only or not job.height:
+        return 1
+    if job.segments > 1:
+        return cpu_count  # the pieces share out the whole machine
+    # x264/x265 frame threading stops scaling at about one thread per 180 lines of picture,
+    # and on short clips ffmpeg start-up dominates, so those run narrow and side by side.
+    threads = max(1, job.height // 180)
+    if job.duration < 30:
+        threads = min(threads, 2)
+    return min(threads, cpu_count)
+
+
+def warm_up():
+    # Resolves the ffmpeg binary ahead of the first conversion (may download it on first run)
+    ffmpeg_binary()
+
+
+def schedule_order(jobs):
+    return sorted(jobs, key=lambda job: job.weight, reverse=True)
+
+
+def run_scheduled(jobs, convert, on_done=None, cpu_count=None, audio_only=False, token=None, threads=None, max_jobs=None):
+    # Starts jobs while the sum of their encoder threads fits in cpu_count, longest first,
+    # so N concurrent transcodes follow from the mix of inputs instead of a fixed number.
+    # convert(job) runs on a worker thread; on_done(job, error) runs in the calling thread.
+    # convert may return a Future for work that no longer needs the CPU (write-back): the job's
+    # threads are freed at once and on_done waits for that Future.
+    # An explicit threads count replaces the per-job estimate, except that a segmented job still takes the
+    # whole machine and threads sets each of its pieces' encoders instead; max_jobs caps N.
+    cpu_count = cpu_count or os.cpu_count() or 1
+    for job in jobs:
+        if job.segments > 1:
+            job.threads = plan_threads(job, cpu_count, audio_only)
+            job.encoder_threads = threads
+        else:
+            job.threads = threads or plan_threads(job, cpu_count, audio_only)
+    pending = schedule_order(jobs)
+    running = {}
+    writing = {}
+    free = cpu_count
+
+    with ThreadPoolExecutor(max_workers=cpu_count) as executor:
+        try:
+            while pending or running or writing:
+                if token and not running:
+                    token.wait_while_paused()
+                if token and token.cancelled:
+                    pending = []
+                for job in list(pending):
+                    if token and token.paused:
+                        break
+                    if max_jobs and len(running) >= max_jobs:
+                        break
+                    if job.threads <= free or not running:
+                        pending.remove(job)
+                        free -= job.threads
+                        running[executor.submit(convert, job)] = job
+                if not running and not writing:
+                    continue
+                finished, _ = wait([*running, *writing], return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in writing:
+                        job = writing.pop(future)
+                    else:
+                        job = running.pop(future)
+                        free += job.threads
+                        if not future.exception() and isinstance(future.result(), Future):
+                            writing[future.result()] = job
+                            continue
+                    if on_done:
+                        on_done(job, future.exception())
+        except KeyboardInterrupt:
+            # Ctrl+C: the pool would wait for the running jobs on the way out; cancelled instead,
+            # their batch stays in the journal for --resume
+            if token:
+                token.cancel()
+            raise
+    if token:
+        token.check()
+
+
+def quality_args(codec, encoder_options):
+    # encoder_options: {'preset': one of PRESETS, 'crf': int, 'bitrate': '4M'}, any of them optional
+    preset = encoder_options.get('preset')
+    crf = encoder_options.get('crf')
+    bitrate = encoder_options.get('bitrate')
+    args = []
+    if codec in ['libx264', 'libx265']:
+        if preset:
+            args += ['-preset', preset]
+        if crf is not None:
+            args += ['-crf', str(crf)]
+    elif codec in ['libvpx', 'libvpx-vp9']:
+        if preset:
+            args += ['-deadline', 'realtime' if VPX_CPU_USED[preset] > 5 else 'good', '-cpu-used', str(VPX_CPU_USED[preset])]
+        if crf is not None:
+            args += ['-crf', str(crf)]
+            if not bitrate:
+                args += ['-b:v', '0']  # constant quality mode
+    if bitrate:
+        args += ['-b:v', bitrate]
+    return args
+
+
+def encode_args(job, output_format, codec, fps=None, audio=True, encoder_options=None):
+    if output_format in AUDIO_FORMATS:
+        # Only the first audio stream is mapped, so video packets are dropped by the demuxer and never decoded
+        args = ['-map', '0:a:0', '-vn', '-sn', '-dn', '-c:a', codec]
+        if codec in ['opus', 'libopus']:
+            args += ['-ar', '48000']
+        if codec == 'opus':
+            args += ['-strict', '-2']  # ffmpeg's native Opus encoder is still marked experimental
+        return args
+    args = ['-map', '0:v:0', '-c:v', codec, '-threads', str(job.threads), *quality_args(codec, encoder_options or {})]
+    if fps:
+        args += ['-r', str(fps)]
+    if codec in ['libx264', 'libx265'] and job.width % 2 == 0 and job.height % 2 == 0:
+        args += ['-pix_fmt', 'yuv420p']  # as moviepy does, so players without 4:4:4 support can open it
+    if audio and first_stream(job.info, 'audio'):
+        args += ['-map', '0:a:0', '-c:a', VIDEO_AUDIO_CODECS.get(output_format, 'aac')]
+    else:
+        args += ['-an']
+    return args
+
+
+def progress_logger(job, output_format, fps, logger):
+    # Feeds ffmpeg -progress to a proglog logger on the bars moviepy uses ('t' for frames, 'chunk' for audio),
+    # with the bytes ffmpeg has written so far as `written`
+    if not logger:
+        return None
+    if output_format in AUDIO_FORMATS:
+        logger(chunk__total=max(1, int(job.duration * 1000)))
+        return lambda progress: logger(chunk__index=parse_int(progress.get('out_time_us')) // 1000, written=parse_int(progress.get('total_size')))
+    video = first_stream(job.info, 'video') or {}
+    logger(t__total=max(1, int(job.duration * (fps or video.get('fps') or 25))))
+    return lambda progress: logger(t__index=parse_int(progress.get('frame')), written=parse_int(progress.get('total_size')))
+
+
+def transcode(job, output_format, codec, fps=None, audio=True, logger=None, token=None, encoder_options=None):
+    # One ffmpeg process decodes and encodes, instead of moviepy piping every frame through numpy
+    args = encode_args(job, output_format, codec, fps, audio, encoder_options)
+    run_ffmpeg(['-i', job.input_path, *args, job.output_path], token, progress_logger(job, output_format, fps, logger), job.profile)
+
+
+def transcode_chunked(job, output_format, codec, fps=None, audio=True, logger=None, token=None, encoder_options=None):
+    # Split-and-merge for one long video: its pieces encode in parallel processes, as many at once as job.threads
+    # holds pieces of job.encoder_threads (an even share of job.threads when not given)
+    piece = copy.copy(job)
+    piece.threads = job.encoder_threads or max(1, job.threads // min(job.segments, job.threads))
+    workers = max(1, min(job.segments, job.threads // piece.threads))
+    video_args = encode_args(piece, output_format, codec, fps, False, encoder_options)
+    audio_args = None
+    if audio and first_stream(job.info, 'audio'):
+        audio_args = ['-map', '0:a:0', '-vn', '-c:a', VIDEO_AUDIO_CODECS.get(output_format, 'aac')]
+    encode_chunked(job.input_path, job.output_path, job.duration, job.segments, workers, video_args, audio_args,
+                   segment_extension(codec, output_format), token, progress_logger(job, output_format, fps, logger), job.profile)
+
+
+def remux(job, output_format, copy_args, logger=None, token=None):
+    run_ffmpeg(['-i', job.input_path, *copy_args, job.output_path], token, progress_logger(job, output_format, None, logger), job.profile)
+
+
+def write_with_moviepy(job, output_format, codec, fps=None, audio=True, logger=None, encoder_options=None):
+    # moviepy's frame loop, for inputs the probe couldn't read
+    if output_format in AUDIO_FORMATS:
+        # The audio reader alone; a VideoFileClip would start the video reader and decode a frame first
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+        clip = AudioFileClip(job.input_path)
+        try:
+            clip.write_audiofile(job.output_path, codec=codec, logger=logger, fps=48000 if codec in ['opus', 'libopus'] else None)
+        finally:
+            clip.close()
+        return
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    clip = VideoFileClip(job.input_path)
+    try:
+        clip.write_videofile(
+            job.output_path,
+            codec=codec,
+            fps=fps,
+            audio=audio,
+            # moviepy puts its temporary soundtrack in the cwd by default, which collides between parallel jobs
+            temp_audiofile=job.output_path + '.snd.' + ('ogg' if output_format in ['ogv', 'webm'] else 'mp3'),
+            threads=job.threads,
+            ffmpeg_params=quality_args(codec, encoder_options or {}),
+            logger=logger
+        )
+    finally:
+        clip.close()
+
+
+def convert_video(job, output_format, codec, fps=None, audio=True, encoder_options=None, logger=None, token=None, cache=None):
+    encoder_options = encoder_options or {}
+    if job.info and output_format in AUDIO_FORMATS and not first_stream(job.info, 'audio'):
+        raise ValueError(f"{job.input_path} has no audio stream")
+    # Written under a partial name and renamed once complete
+    partial = copy.copy(job)
+    partial.output_path = partial_path(job.output_path)
+    profile = job.profile
+    reencode = any(value is not None for value in encoder_options.values())
+    copy_args = remux_args(job.info, output_format, codec, fps, audio) if job.info and not reencode else None
+    key = None
+    # A remux reads the source once anyway, so hashing it for the cache would only double that
+    if cache and not copy_args and cache.covers(job.input_path):
+        params = {'kind': 'video', 'format': output_format, 'codec': codec, 'fps': fps, 'audio': audio, 'quality': encoder_options}
+        with profile.stage('hash'):
+            key = cache.key(job.input_path, params)
+        with profile.stage('write'):
+            profile.cached = cache.fetch(key, partial.output_path)
+            if profile.cached:
+                os.replace(partial.output_path, job.output_path)
+        if profile.cached:
+            return
+    try:
+        with profile.stage('encode'):
+            if copy_args:
+                # The streams already fit the target: copy the bitstream instead of decoding every frame
+                remux(partial, output_format, copy_args, logger, token)
+            elif job.info and job.segments > 1:
+                transcode_chunked(partial, output_format, codec, fps, audio, logger, token, encoder_options)
+            elif job.info:
+                transcode(partial, output_format, codec, fps, audio, logger, token, encoder_options)
+            else:
+                write_with_moviepy(partial, output_format, codec, fps, audio, logger, encoder_options)
+        with profile.stage('write'):
+            os.replace(partial.output_path, job.output_path)
+    except BaseException:
+        remove_partial(partial.output_path, partial.output_path + '.snd.ogg', partial.output_path + '.snd.mp3')
+        raise
+    if key:
+        with profile.stage('write'):
+            cache.store(key, job.output_path)
+
+
+def convert_staged(pipeline, job, convert):
+    # convert(job) on a copy of job that reads a prefetched input and writes to scratch -> write-back Future
+    def convert_local(input_path, output_paths):
+        staged = copy.copy(job)
+        staged.input_path, staged.output_path = input_path, output_paths[0]
+        convert(staged)
+
+    return pipeline.stage(job.input_path, [job.output_path], convert_local)
+
+
+def record_metrics(metrics, job, error, handed_over=None):
+    # handed_over: when a staged job's output was queued for write-back, which then counts as write time
+    if not metrics or isinstance(error, ConversionCancelled):
+        return
+    if handed_over:
+        job.profile.add('write', time.perf_counter() - handed_over)
+    metrics.record(job.profile.record([job.output_path], error))
+
+
+def run_batch(kind, settings, input_paths, output_format, output_dir, template, convert_one, on_start=None, on_done=None, token=None,
+              staging=None, journal=None, batch=None, metrics=None, prepare=None, audio_only=False, threads=None, max_jobs=None):
+    # The batch around one engine's convert_one(job, logger), for the video, audio and GIF engines: output names
+    # planned (or taken from the journal when resuming), inputs probed, staged and scheduled by CPU budget, and
+    # each job journaled and recorded in metrics. The batch is journaled as kind with settings, which are the
+    # engine's keyword arguments for a resume. prepare(jobs) adjusts the probed jobs before they are scheduled;
+    # audio_only, threads and max_jobs go to run_scheduled.
+    plan = lambda: output_paths(input_paths, output_format, output_dir, template=template)
+    batch, planned = journal.begin(kind, settings, plan, batch) if journal else (None, plan())
+    jobs = [probe_video(input_path, output_path) for input_path, output_path in planned]
+    for job in jobs:
+        job.profile.kind = kind
+    if prepare:
+        prepare(jobs)
+    pipeline = staging.start([job.input_path for job in schedule_order(jobs)]) if staging else None
+    handed_over = {}  # job -> when its output went to the write-back queue
+
+    def done(job, error):
+        if journal:
+            journal.update(batch, job.input_path, FAILED if error else DONE, error)
+        record_metrics(metrics, job, error, handed_over.pop(job, None))
+        if on_done:
+            on_done(job, error)
+
+    def convert(job):
+        if token:
+            token.check()
+        job.profile.start()
+        if journal:
+            journal.update(batch, job.input_path, RUNNING)
+        logger = on_start(job) if on_start else None
+        if pipeline:
+            future = convert_staged(pipeline, job, lambda job: convert_one(job, logger))
+            handed_over[job] = time.perf_counter()
+            return future
+        convert_one(job, logger)
+
+    try:
+        run_scheduled(jobs, convert, done, audio_only=audio_only, token=token, threads=threads, max_jobs=max_jobs)
+    except ConversionCancelled:
+        if journal:
+            journal.finish(batch)  # cancelled on purpose, nothing to resume
+        raise
+    finally:
+        if pipeline:
+            pipeline.close()
+        release_unused(*[job.output_path for job in jobs])
+    if journal:
+        journal.finish(batch)
+
+
+def convert_videos(input_paths, output_format, codec, fps=None, audio=True, encoder_options=None, threads=None,
+                   output_dir=None, max_jobs=None, on_start=None, on_done=None, token=None, cache=None, staging=None, journal=None, batch=None,
+                   template=None, segments=None, metrics=None):
+    # on_start(job) runs on the worker thread and may return a proglog logger for that job;
+    # on_done(job, error) runs in the calling thread as each job finishes.
+    # staging (pipeline.Staging) reads inputs ahead into local scratch and writes outputs back behind.
+    # journal (journal.JobJournal) records the batch as it goes; batch resumes an unfinished one, in which case
+    # input_paths is ignored and the settings should be the ones it was recorded with.
+    # template: output file name template, see naming.DEFAULT_TEMPLATE.
+    # segments: videos long enough are cut into up to that many pieces encoded side by side (video_chunks).
+    # metrics (metrics.MetricsLog) gets each finished job's profile.
+    settings = {'output_format': output_format, 'codec': codec, 'fps': fps, 'audio': audio, 'encoder_options': encoder_options,
+                'threads': threads, 'output_dir': output_dir, 'max_jobs': max_jobs, 'template': template, 'segments': segments}
+
+    def prepare(jobs):
+        if output_format not in AUDIO_FORMATS:
+            for job in jobs:
+                job.segments = segment_count(job, segments)
+
+    run_batch('video', settings, input_paths, output_format, output_dir, template,
+              lambda job, logger: convert_video(job, output_format, codec, fps, audio, encoder_options, logger, token, cache),
+              on_start, on_done, token, staging, journal, batch, metrics, prepare,
+              audio_only=output_format in AUDIO_FORMATS, threads=threads, max_jobs=max_jobs)
+
+
+def parse_int(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
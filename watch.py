@@ -0,0 +1,296 @@
+from cache import default_cache_dir
+from jobs import partial_path, remove_partial
+from naming import release_unused
+import threading
+import sqlite3
+import select
+import struct
+import queue
+import time
+import sys
+import os
+
+
+SETTLE_SECONDS = 2  # a file is picked up once its size and mtime have held this long
+SETTLE_CHECK = 0.5
+POLL_SECONDS = 5
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+def default_watch_dir():
+    # The watch journal and index, apart from the batch journal so `--resume` never picks up watch batches
+    return os.path.join(default_cache_dir(), 'watch')
+
+
+class ProcessedIndex():
+    # Inputs a watch has converted (or failed on), with the size and mtime they had then, per profile:
+    # the target settings as JSON, so a folder watched for two targets is tracked once for each.
+    # A restart lists the folder and skips what was converted, instead of converting it again; failed
+    # and cancelled inputs are kept with their error but tried again.
+    def __init__(self, path=None):
+        self.path = path or os.path.join(default_watch_dir(), 'index.sqlite3')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS processed (
+                profile TEXT NOT NULL, input_path TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL,
+                error TEXT, processed REAL NOT NULL, PRIMARY KEY (profile, input_path))
+        ''')
+
+    def load(self, profile):
+        # -> {input path: (size, mtime)}
+        with self.lock:
+            rows = self.connection.execute('SELECT input_path, size, mtime FROM processed WHERE profile = ? AND error IS NULL',
+                                           (profile,)).fetchall()
+        return {input_path: (size, mtime) for input_path, size, mtime in rows}
+
+    def mark(self, profile, input_path, size, mtime, error=None):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)',
+                                    (profile, input_path, size, mtime, str(error) if error else None, time.time()))
+
+
+class Inotify():
+    # Linux inotify through libc; OSError where it isn't available (other systems, watch limit reached)
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is Linux only')
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}  # watch descriptor -> folder
+
+    def add(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), INOTIFY_MASK)
+        if wd < 0:
+            raise OSError(self.ctypes.get_errno(), f'Cannot watch {folder}: {os.strerror(self.ctypes.get_errno())}')
+        self.watches[wd] = folder
+
+    def read(self, timeout):
+        # -> [(path, mask)], path None when the kernel queue overflowed; [] after timeout
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif wd in self.watches and name:
+                events.append((os.path.join(self.watches[wd], os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def recover(journal):
+    # Batches a killed watch left running: their placeholders and partial outputs are removed, so the
+    # inputs, which the index doesn't list yet, get the same names when converted again. Batches of
+    # watches still running are not in unfinished(), and one another watch recovers first fails to claim.
+    for batch, _, _, _ in journal.unfinished():
+        if not journal.claim(batch):
+            continue
+        for _, outputs in journal.jobs(batch):
+            outputs = outputs if isinstance(outputs, list) else [outputs]
+            remove_partial(*[partial_path(output_path) for output_path in outputs])
+            release_unused(*outputs)
+        journal.finish(batch)
+
+
+class FolderWatch():
+    # Drop-folder mode: files arriving in `folders` are converted with convert(input_paths, on_done, token),
+    # on_done(input_path, output_path, error) per output as for the engines.
+    # inotify events (or a poll every poll_seconds where inotify isn't available) make a file pending; the
+    # settle thread hands it on once its size and mtime held for settle_seconds. The ready queue is bounded:
+    # while the engine is busy and the queue is full, files stay pending instead of piling up in memory.
+    # Each engine call takes up to queue_size ready files as one batch, with the engine's own worker limit.
+    def __init__(self, folders, extensions, convert, index, profile, token, recursive=False, settle_seconds=SETTLE_SECONDS,
+                 poll_seconds=None, queue_size=8, excluded=None, on_done=None):
+        # poll_seconds forces polling; excluded: folders never picked up from (the output folder)
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.extensions = extensions
+        self.convert = convert
+        self.index = index
+        self.profile = profile
+        self.token = token
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.queue_size = queue_size
+        self.excluded = [os.path.abspath(folder) for folder in excluded or []]
+        self.on_done = on_done
+        self.processed = index.load(profile)
+        self.known = {}  # path -> (size, mtime) at the last scan, for polling
+        self.pending = {}  # path -> (size, mtime, unchanged since)
+        self.in_flight = set()  # queued or converting
+        self.lock = threading.Lock()
+        self.ready = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+
+    def wanted(self, path):
+        name = os.path.basename(path)
+        if name.startswith(('.', '~')) or '.part.' in name:
+            return False  # hidden, editor lock files, our own partial outputs
+        if any(path == folder or path.startswith(folder + os.sep) for folder in self.excluded):
+            return False
+        return os.path.splitext(name)[1].lower() in self.extensions
+
+    def notice(self, path):
+        if not self.wanted(path):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return  # gone again
+        state = (stat.st_size, stat.st_mtime)
+        with self.lock:
+            if path in self.in_flight or path in self.pending or self.processed.get(path) == state:
+                return
+            self.pending[path] = (*state, time.monotonic())
+
+    def scan(self, folder=None):
+        # -> [(path, size, mtime)] of the files under folder (all watched folders by default)
+        found = []
+        for top in [folder] if folder else self.folders:
+            try:
+                walk = os.walk(top) if self.recursive else [(top, [], [entry.name for entry in os.scandir(top) if entry.is_file()])]
+            except OSError:
+                continue  # folder removed or unreachable (network share); picked up again once it's back
+            for directory, _, names in walk:
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((path, stat.st_size, stat.st_mtime))
+        return found
+
+    def notice_scan(self, folder=None):
+        for path, size, mtime in self.scan(folder):
+            if self.known.get(path) != (size, mtime):
+                self.known[path] = (size, mtime)
+                self.notice(path)
+
+    def poll(self):
+        while not self.stopped.wait(self.poll_seconds or POLL_SECONDS):
+            self.notice_scan()
+
+    def listen(self, inotify):
+        try:
+            while not self.stopped.is_set():
+                for path, mask in inotify.read(1):
+                    if path is None:
+                        self.notice_scan()  # events were lost
+                    elif mask & IN_ISDIR:
+                        if self.recursive:
+                            inotify.add(path)
+                            self.notice_scan(path)  # files moved in with the folder, or written before the watch was added
+                    else:
+                        self.notice(path)
+        finally:
+            inotify.close()
+
+    def start_events(self):
+        # -> 'inotify' or 'polling'
+        if not self.poll_seconds:
+            try:
+                inotify = Inotify()
+                for folder in self.folders:
+                    walk = os.walk(folder) if self.recursive else [(folder, [], [])]
+                    for directory, _, _ in walk:
+                        inotify.add(directory)
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable ({e}), polling every {POLL_SECONDS} s instead", file=sys.stderr)
+            else:
+                threading.Thread(target=self.listen, args=(inotify,), daemon=True).start()
+                return 'inotify'
+        threading.Thread(target=self.poll, daemon=True).start()
+        return 'polling'
+
+    def settle(self):
+        while not self.stopped.wait(SETTLE_CHECK):
+            now = time.monotonic()
+            settled = []
+            with self.lock:
+                for path, (size, mtime, since) in list(self.pending.items()):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        del self.pending[path]
+                        continue
+                    if (stat.st_size, stat.st_mtime) != (size, mtime):
+                        self.pending[path] = (stat.st_size, stat.st_mtime, now)
+                    elif now - since >= self.settle_seconds:
+                        del self.pending[path]
+                        self.in_flight.add(path)
+                        settled.append((path, size, mtime))
+            for item in settled:
+                # Blocks while the queue is full, which holds everything after it in pending
+                while not self.stopped.is_set():
+                    try:
+                        self.ready.put(item, timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+
+    def run(self):
+        # Converts until the token is cancelled or Ctrl+C
+        mode = self.start_events()
+        self.notice_scan()  # what arrived while no watch was running
+        threading.Thread(target=self.settle, daemon=True).start()
+        print(f"Watching {', '.join(self.folders)} ({mode}), {len(self.processed)} files already processed")
+        try:
+            while not self.token.cancelled:
+                try:
+                    batch = [self.ready.get(timeout=1)]
+                except queue.Empty:
+                    continue
+                while len(batch) < self.queue_size:
+                    try:
+                        batch.append(self.ready.get_nowait())
+                    except queue.Empty:
+                        break
+                self.convert_batch(batch)
+        finally:
+            self.stopped.set()
+
+    def convert_batch(self, batch):
+        states = {path: (size, mtime) for path, size, mtime in batch}
+        errors = {}
+
+        def on_done(input_path, output_path, error):
+            # Several outputs per input (image sizes): a failure on any of them is what gets recorded
+            errors[input_path] = errors.get(input_path) or error
+            self.index.mark(self.profile, input_path, *states[input_path], errors[input_path])
+            if errors[input_path]:
+                # tried again once the file changes or the watch restarts
+                self.processed.pop(input_path, None)
+            else:
+                self.processed[input_path] = states[input_path]
+            if self.on_done:
+                self.on_done(input_path, output_path, error)
+
+        try:
+            self.convert(list(states), on_done, self.token)
+        finally:
+            with self.lock:
+                self.in_flight.difference_update(states)